@@ -0,0 +1,82 @@
+"""
+Measure master memory per chunk for the compact ChunkTable against the
+dict-of-lists layout that chunk_locations used before.
+
+Each measurement runs in a fresh process and reports the growth of its
+resident set size while the table is filled.
+
+Usage: python benchmarks/chunk_table_memory.py [--chunks 1000000 10000000]
+"""
+
+import os
+import sys
+import time
+import argparse
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from chunktable import ChunkTable
+
+LAYOUTS = {"ChunkTable": ChunkTable, "dict": dict}
+
+
+def resident_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak RSS is the best portable approximation (KB on Linux, bytes on macOS)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+def measure(layout, num_chunks, num_servers, replicas, results):
+    servers = [["127.0.0.1", 6000 + 2 * i] for i in range(num_servers)]
+    before = resident_bytes()
+    start = time.perf_counter()
+    table = LAYOUTS[layout]()
+    for chunk_id in range(num_chunks):
+        table[chunk_id] = [
+            list(servers[(chunk_id + r) % num_servers]) for r in range(replicas)
+        ]
+    elapsed = time.perf_counter() - start
+    results.put((resident_bytes() - before, elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--servers", type=int, default=100)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument(
+        "--dict-limit",
+        type=int,
+        default=1_000_000,
+        help="Largest chunk count to also measure the dict baseline for",
+    )
+    args = parser.parse_args()
+
+    print(f"{'layout':<12}{'chunks':>12}{'bytes/chunk':>14}{'RSS MB':>10}{'build s':>10}")
+    for num_chunks in args.chunks:
+        layouts = ["ChunkTable"]
+        if num_chunks <= args.dict_limit:
+            layouts.append("dict")
+        for layout in layouts:
+            results = multiprocessing.Queue()
+            worker = multiprocessing.Process(
+                target=measure,
+                args=(layout, num_chunks, args.servers, args.replicas, results),
+            )
+            worker.start()
+            grown, elapsed = results.get()
+            worker.join()
+            print(
+                f"{layout:<12}{num_chunks:>12}{grown / num_chunks:>14.1f}"
+                f"{grown / 2**20:>10.1f}{elapsed:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
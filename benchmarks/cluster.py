@@ -0,0 +1,308 @@
+"""
+Benchmark a local GFS cluster under a mixed client workload.
+
+Starts a master and N chunk servers as separate processes on loopback
+ports, each run in a fresh working directory so no metadata or chunk
+files are shared between runs. The files are created first, then client
+processes issue read, write, append and write_offset operations through
+Client in the given mix for a fixed duration. Throughput and p50/p99/p999
+latency per operation are printed and written as JSON.
+
+Usage: python benchmarks/cluster.py [--chunkservers 3] [--clients 4]
+           [--duration 10] [--mix read=70,write=10,append=10,write_offset=10]
+           [--size 48] [--output results.json]
+"""
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+import contextlib
+import multiprocessing
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from client import Client
+
+OPERATIONS = ("read", "write", "append", "write_offset")
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name!r}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def wait_for_port(port, process, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process on port {port} exited with {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+class Cluster:
+    """
+    A master and chunk servers running as subprocesses in workdir. Chunk
+    servers also listen on port + 1, so their ports are spaced by two.
+    """
+
+    def __init__(self, workdir, master_port, num_chunkservers, master_args=()):
+        self.workdir = workdir
+        self.master_port = master_port
+        self.chunkserver_ports = [
+            master_port + 2 * (i + 1) for i in range(num_chunkservers)
+        ]
+        self.master_args = list(master_args)
+        self.processes = []
+
+    def spawn(self, script, args, log_name):
+        log = open(os.path.join(self.workdir, log_name), "w")
+        process = subprocess.Popen(
+            [sys.executable, "-u", os.path.join(ROOT, script)] + args,
+            cwd=self.workdir,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        log.close()
+        self.processes.append(process)
+        return process
+
+    def start(self):
+        master = self.spawn(
+            "master.py",
+            [
+                "--port",
+                str(self.master_port),
+                "--metrics-port",
+                str(self.master_port + 2 * len(self.chunkserver_ports) + 2),
+            ]
+            + self.master_args,
+            "master.log",
+        )
+        wait_for_port(self.master_port, master)
+        for port in self.chunkserver_ports:
+            chunkserver = self.spawn(
+                "chunkserver.py",
+                [str(port), "--master-port", str(self.master_port)],
+                f"chunkserver_{port}.log",
+            )
+            # Chunk servers register with the master before they listen
+            wait_for_port(port, chunkserver)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+def payload(rng, size):
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(size))
+
+
+def run_operation(client, rng, operation, filename, size):
+    if operation == "read":
+        client.read(filename)
+    elif operation == "write":
+        client.write(filename, payload(rng, size))
+    elif operation == "append":
+        client.record_append(filename, payload(rng, min(size, client.chunk_size)))
+    elif operation == "write_offset":
+        client.write_offset(filename, payload(rng, size), rng.randrange(size))
+
+
+def run_client(workdir, master_port, weights, files, size, duration, seed):
+    """
+    Issue operations until duration runs out. Returns latencies in seconds
+    and error counts by operation.
+    """
+    os.chdir(workdir)  # Client.read downloads into ./client_files
+    rng = random.Random(seed)
+    client = Client("127.0.0.1", master_port)
+    names = list(weights)
+    name_weights = list(weights.values())
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+
+    deadline = time.perf_counter() + duration
+    # Client reports progress on stdout, keep it out of the results
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        while time.perf_counter() < deadline:
+            operation = rng.choices(names, name_weights)[0]
+            filename = f"bench/file_{rng.randrange(files)}"
+            start = time.perf_counter()
+            try:
+                run_operation(client, rng, operation, filename, size)
+                failed = "Error" in output.getvalue()
+            except Exception:
+                failed = True
+            if failed:
+                errors[operation] += 1
+            else:
+                latencies[operation].append(time.perf_counter() - start)
+            output.seek(0)
+            output.truncate()
+    return latencies, errors
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of a non-empty sorted list."""
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(latencies, errors, duration):
+    ordered = sorted(latencies)
+    summary = {
+        "ops": len(ordered),
+        "errors": errors,
+        "ops_per_sec": len(ordered) / duration,
+    }
+    if ordered:
+        summary["mean_ms"] = sum(ordered) / len(ordered) * 1000
+        for name, fraction in (("p50", 0.50), ("p99", 0.99), ("p999", 0.999)):
+            summary[f"{name}_ms"] = percentile(ordered, fraction) * 1000
+    return summary
+
+
+def run_benchmark(args):
+    weights = args.mix
+    workdir = tempfile.mkdtemp(prefix="gfs_cluster_")
+    cluster = Cluster(workdir, args.port, args.chunkservers, args.master_args)
+    try:
+        cluster.start()
+
+        setup = Client("127.0.0.1", args.port)
+        rng = random.Random(args.seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            setup.mkdir("bench")
+            for i in range(args.files):
+                setup.write(f"bench/file_{i}", payload(rng, args.size))
+
+        with multiprocessing.Pool(args.clients) as pool:
+            outcomes = pool.starmap(
+                run_client,
+                [
+                    (
+                        workdir,
+                        args.port,
+                        weights,
+                        args.files,
+                        args.size,
+                        args.duration,
+                        args.seed + client_id + 1,
+                    )
+                    for client_id in range(args.clients)
+                ],
+            )
+    finally:
+        cluster.stop()
+        if args.keep:
+            print(f"Cluster files kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {}
+    everything = []
+    total_errors = 0
+    for name in weights:
+        latencies = [value for outcome in outcomes for value in outcome[0][name]]
+        errors = sum(outcome[1][name] for outcome in outcomes)
+        results[name] = summarize(latencies, errors, args.duration)
+        everything.extend(latencies)
+        total_errors += errors
+    results["total"] = summarize(everything, total_errors, args.duration)
+
+    return {
+        "config": {
+            "chunkservers": args.chunkservers,
+            "clients": args.clients,
+            "duration": args.duration,
+            "mix": weights,
+            "size": args.size,
+            "files": args.files,
+            "master_args": args.master_args,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def print_results(report):
+    print(
+        f"{'operation':<14}{'ops':>8}{'errors':>8}{'ops/sec':>10}"
+        f"{'p50 ms':>9}{'p99 ms':>9}{'p999 ms':>9}"
+    )
+    for name, result in report["results"].items():
+        if not result["ops"]:
+            print(f"{name:<14}{0:>8}{result['errors']:>8}")
+            continue
+        print(
+            f"{name:<14}{result['ops']:>8}{result['errors']:>8}"
+            f"{result['ops_per_sec']:>10.1f}{result['p50_ms']:>9.2f}"
+            f"{result['p99_ms']:>9.2f}{result['p999_ms']:>9.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunkservers", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default="read=70,write=10,append=10,write_offset=10",
+        help="Operation weights, operations are read, write, append, write_offset",
+    )
+    parser.add_argument("--size", type=int, default=48, help="Bytes per write")
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--port", type=int, default=7000, help="Master port")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the cluster's working directory"
+    )
+    parser.add_argument(
+        "--master-arg",
+        dest="master_args",
+        action="append",
+        default=[],
+        help="Extra master.py argument, repeatable (e.g. --master-arg=--async)",
+    )
+    args = parser.parse_args()
+    if args.chunkservers < 3:
+        parser.error("The master places every chunk on 3 chunk servers")
+
+    report = run_benchmark(args)
+    print_results(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
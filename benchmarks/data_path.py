@@ -0,0 +1,167 @@
+"""
+Compare chunk data throughput of JSON string content and raw binary content.
+
+For each payload size a sender thread answers chunk READs the way a chunk
+server does, opening the chunk file for every response, and streams them
+to a receiver over a loopback TCP connection for a fixed duration. The
+json mode is the old path: the chunk is read in text mode, carried as a
+JSON string and encoded back to bytes by the receiver. The binary mode
+reads the chunk into memory and sends it raw after the JSON header with
+send_message. The sendfile mode sends the same framing with send_file,
+which streams the file to the socket without copying it into Python.
+Payloads are printable ASCII, the best case for JSON strings; other bytes
+only get slower.
+
+Usage: python benchmarks/data_path.py [--sizes 4096,65536,1048576,8388608]
+           [--duration 3] [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import random
+import argparse
+import tempfile
+import threading
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from protocol import HEADER, send_message, send_file, recv_message, recv_frame
+
+MODES = ("json", "binary", "sendfile")
+
+
+def send_json(sock, path):
+    with open(path, "r") as f:
+        payload = json.dumps({"status": "OK", "content": f.read()}).encode()
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def recv_json(sock):
+    payload = recv_frame(sock)
+    if payload is None:
+        return None
+    return json.loads(payload)["content"].encode("utf-8")
+
+
+def send_binary(sock, path):
+    with open(path, "rb") as f:
+        send_message(sock, {"status": "OK", "content": f.read()})
+
+
+def recv_binary(sock):
+    message = recv_message(sock)
+    if message is None:
+        return None
+    return message["content"]
+
+
+def send_chunk_file(sock, path):
+    with open(path, "rb") as f:
+        send_file(sock, {"status": "OK"}, f, os.fstat(f.fileno()).st_size)
+
+
+SENDERS = {"json": send_json, "binary": send_binary, "sendfile": send_chunk_file}
+RECEIVERS = {"json": recv_json, "binary": recv_binary, "sendfile": recv_binary}
+
+
+def connected_pair():
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        sender = socket.create_connection(server.getsockname())
+        receiver, _ = server.accept()
+    return sender, receiver
+
+
+def bench(mode, path, size, duration):
+    """
+    Stream the size bytes file at path for duration seconds. Returns
+    (messages, bytes received, seconds) as seen by the receiver.
+    """
+    sender, receiver = connected_pair()
+    send = SENDERS[mode]
+    deadline = time.perf_counter() + duration
+
+    def produce():
+        with sender:
+            while time.perf_counter() < deadline:
+                send(sender, path)
+
+    thread = threading.Thread(target=produce)
+    start = time.perf_counter()
+    thread.start()
+    messages = received = 0
+    with receiver:
+        while True:
+            data = RECEIVERS[mode](receiver)
+            if data is None:
+                break
+            if len(data) != size:
+                raise RuntimeError(f"Received {len(data)} of {size} bytes")
+            messages += 1
+            received += len(data)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    return messages, received, elapsed
+
+
+def parse_sizes(sizes):
+    try:
+        return [int(size) for size in sizes.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid size list {sizes!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=parse_sizes,
+        default=[4096, 65536, 1048576, 8388608],
+        help="Comma separated payload sizes in bytes",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=3, help="Seconds per size and mode"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    alphabet = bytes(range(ord(" "), ord("~") + 1))
+    results = []
+    print(
+        f"{'size':>10}{'json MB/s':>12}{'binary MB/s':>13}"
+        f"{'sendfile MB/s':>15}{'speedup':>9}"
+    )
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "chunk.dat")
+        for size in args.sizes:
+            with open(path, "wb") as f:
+                f.write(bytes(rng.choice(alphabet) for _ in range(size)))
+            row = {"size": size}
+            for mode in MODES:
+                messages, received, elapsed = bench(mode, path, size, args.duration)
+                row[mode] = {
+                    "messages": messages,
+                    "mb_per_sec": received / elapsed / 1e6,
+                }
+            speedup = row["sendfile"]["mb_per_sec"] / row["json"]["mb_per_sec"]
+            row["speedup"] = speedup
+            results.append(row)
+            print(
+                f"{size:>10}{row['json']['mb_per_sec']:>12.1f}"
+                f"{row['binary']['mb_per_sec']:>13.1f}"
+                f"{row['sendfile']['mb_per_sec']:>15.1f}{speedup:>8.1f}x"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"duration": args.duration, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Compare master metadata throughput of the threaded and asyncio server modes.
+
+Each mode runs a fresh master process on loopback, registers placeholder
+chunk servers, creates a set of files and then lets several client
+processes issue READ lookups for a fixed duration over persistent
+connections (or one connection per request with --one-shot).
+
+Usage: python benchmarks/master_rpc.py [--clients 8] [--duration 10]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from protocol import call, send_message, recv_message
+
+
+def send_request(sock, request):
+    send_message(sock, request)
+    return recv_message(sock)
+
+
+def one_shot(port, request):
+    return call(("127.0.0.1", port), request)
+
+
+def wait_for_master(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Master did not start on port {port}")
+
+
+def run_client(port, persistent, num_files, duration, client_id):
+    done = 0
+    deadline = time.perf_counter() + duration
+    sock = socket.create_connection(("127.0.0.1", port)) if persistent else None
+    while time.perf_counter() < deadline:
+        request = {"type": "READ", "filename": f"file_{(client_id + done) % num_files}"}
+        if persistent:
+            response = send_request(sock, request)
+        else:
+            response = one_shot(port, request)
+        if response.get("status") != "OK":
+            raise RuntimeError(f"Unexpected response: {response}")
+        done += 1
+    if sock:
+        sock.close()
+    return done
+
+
+def bench_mode(mode, port, args):
+    workdir = tempfile.mkdtemp(prefix=f"gfs_bench_{mode}_")
+    command = [sys.executable, os.path.join(ROOT, "master.py"), "--port", str(port)]
+    if mode == "asyncio":
+        command.append("--async")
+    master = subprocess.Popen(
+        command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_master(port)
+        for i in range(3):
+            one_shot(
+                port,
+                {"type": "REGISTER_CHUNKSERVER", "address": ["127.0.0.1", 7000 + 2 * i]},
+            )
+        for i in range(args.files):
+            one_shot(port, {"type": "WRITE", "filename": f"file_{i}", "length": 48})
+
+        with multiprocessing.Pool(args.clients) as pool:
+            counts = pool.starmap(
+                run_client,
+                [
+                    (port, not args.one_shot, args.files, args.duration, client_id)
+                    for client_id in range(args.clients)
+                ],
+            )
+        return sum(counts) / args.duration
+    finally:
+        master.kill()
+        master.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument(
+        "--one-shot",
+        action="store_true",
+        help="Open a new connection for every request",
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for offset, mode in enumerate(("threaded", "asyncio")):
+        results[mode] = bench_mode(mode, args.port + 10 * offset, args)
+        print(f"{mode:<10}{results[mode]:>12.0f} READ ops/sec")
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Measure master startup time and memory from a JSON checkpoint against the
+binary checkpoint format.
+
+A synthetic metadata state is written in each format, then a fresh process
+constructs a MasterServer on it and reports the construction time and the
+growth of its peak resident set size.
+
+Usage: python benchmarks/master_startup.py [--chunks 1000000 10000000]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from chunktable import ChunkTable
+from checkpoint import BinaryCheckpoint, JsonCheckpoint
+from master import MasterServer
+
+CODECS = {"json": JsonCheckpoint, "binary": BinaryCheckpoint}
+
+
+def peak_resident_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def make_state(num_chunks, chunks_per_file, num_servers, replicas):
+    slots = 4
+    table = ChunkTable.from_arrays(
+        slots,
+        [("127.0.0.1", 6000 + 2 * i) for i in range(num_servers)],
+        bytearray([replicas]) * num_chunks,
+        array(
+            "H",
+            (
+                (chunk_id + slot) % num_servers if slot < replicas else 0
+                for chunk_id in range(num_chunks)
+                for slot in range(slots)
+            ),
+        ),
+        {},
+        {},
+    )
+    files = {
+        f"dir_{start // (chunks_per_file * 1000)}/file_{start}": list(
+            range(start, min(start + chunks_per_file, num_chunks))
+        )
+        for start in range(0, num_chunks, chunks_per_file)
+    }
+    directories = sorted({name.split("/")[0] for name in files})
+    return {
+        "file_to_chunks": files,
+        "directories": directories,
+        "chunk_locations": table,
+        "next_chunk_id": num_chunks,
+    }
+
+
+def write_checkpoint(root_dir, codec, state):
+    if codec == "json":
+        state = dict(state, chunk_locations=state["chunk_locations"].to_dict())
+    path = os.path.join(root_dir, CODECS[codec].filename)
+    with open(path, "wb") as f:
+        CODECS[codec]().dump(f, 0, state)
+    return os.path.getsize(path)
+
+
+def measure(root_dir, results):
+    before = peak_resident_bytes()
+    start = time.perf_counter()
+    master = MasterServer("127.0.0.1", 0, root_dir=root_dir)
+    elapsed = time.perf_counter() - start
+    results.put((elapsed, peak_resident_bytes() - before, len(master.chunk_locations)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--chunks-per-file", type=int, default=64)
+    parser.add_argument("--servers", type=int, default=100)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument(
+        "--json-limit",
+        type=int,
+        default=1_000_000,
+        help="Largest chunk count to also measure the JSON checkpoint for",
+    )
+    args = parser.parse_args()
+
+    print(f"{'format':<8}{'chunks':>12}{'file MB':>10}{'startup s':>11}{'peak RSS MB':>13}")
+    for num_chunks in args.chunks:
+        state = make_state(num_chunks, args.chunks_per_file, args.servers, args.replicas)
+        codecs = ["binary"]
+        if num_chunks <= args.json_limit:
+            codecs.insert(0, "json")
+        for codec in codecs:
+            root_dir = tempfile.mkdtemp(prefix="master_startup_")
+            try:
+                size = write_checkpoint(root_dir, codec, state)
+                results = multiprocessing.Queue()
+                worker = multiprocessing.Process(target=measure, args=(root_dir, results))
+                worker.start()
+                elapsed, grown, loaded = results.get()
+                worker.join()
+                assert loaded == num_chunks
+                print(
+                    f"{codec:<8}{num_chunks:>12}{size / 2**20:>10.1f}"
+                    f"{elapsed:>11.2f}{grown / 2**20:>13.1f}"
+                )
+            finally:
+                shutil.rmtree(root_dir)
+        del state
+
+
+if __name__ == "__main__":
+    main()
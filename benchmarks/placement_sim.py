@@ -0,0 +1,102 @@
+"""
+Simulate chunk placement on a large cluster and compare how evenly each
+placement policy spreads disk usage and request load.
+
+Servers get uneven capacities and starting fill levels. Chunks get
+Zipf-distributed popularity, so a server's request rate is the total
+popularity of the chunks it holds. Policies only see figures as of the
+last simulated heartbeat, as on the real master.
+
+Usage: python benchmarks/placement_sim.py [--servers 200] [--chunks 50000]
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from placement import PLACEMENT_POLICIES
+
+CHUNK_BYTES = 64 * 2**20
+
+
+def simulate(policy_name, args):
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    policy = PLACEMENT_POLICIES[policy_name]()
+
+    servers = []
+    for i in range(args.servers):
+        capacity = rng.choice([64, 128, 256]) * 2**30
+        servers.append(
+            {
+                "server": ["127.0.0.1", 6000 + 2 * i],
+                "capacity_bytes": capacity,
+                "used_bytes": int(capacity * rng.uniform(0.0, 0.6)),
+                "requests": 0.0,
+            }
+        )
+
+    snapshot = None
+    for chunk in range(args.chunks):
+        if chunk % args.heartbeat_every == 0:
+            # Heartbeat: refresh what the master knows about every server
+            snapshot = [
+                {
+                    "server": server["server"],
+                    "free_bytes": server["capacity_bytes"] - server["used_bytes"],
+                    "capacity_bytes": server["capacity_bytes"],
+                    "num_requests": server["requests"],
+                    "in_flight": 0,
+                    "index": index,
+                }
+                for index, server in enumerate(servers)
+            ]
+            by_address = {tuple(entry["server"]): entry["index"] for entry in snapshot}
+
+        popularity = 1.0 / (chunk % 1000 + 1)  # Zipf over repeating ranks
+        for address in policy.choose(snapshot, args.replicas):
+            server = servers[by_address[tuple(address)]]
+            server["used_bytes"] += CHUNK_BYTES
+            server["requests"] += popularity
+
+    fill = [server["used_bytes"] / server["capacity_bytes"] for server in servers]
+    load = [server["requests"] for server in servers]
+    return {
+        "fill_max_over_mean": max(fill) / (sum(fill) / len(fill)),
+        "load_max_over_mean": max(load) / (sum(load) / len(load)),
+        "fill_max": max(fill),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--servers", type=int, default=200)
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument(
+        "--heartbeat-every",
+        type=int,
+        default=100,
+        help="Chunk allocations between refreshes of server figures",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'policy':<12}{'fill max/mean':>15}{'load max/mean':>15}{'fullest':>10}")
+    for name in sorted(PLACEMENT_POLICIES):
+        results[name] = simulate(name, args)
+        print(
+            f"{name:<12}{results[name]['fill_max_over_mean']:>15.2f}"
+            f"{results[name]['load_max_over_mean']:>15.2f}"
+            f"{results[name]['fill_max']:>10.1%}"
+        )
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
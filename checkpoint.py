@@ -0,0 +1,155 @@
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+from chunktable import ChunkTable
+
+MAGIC = b"GFSCKPT1"
+PREFIX = struct.Struct("!8sI")  # Magic, length of the JSON header
+ALIGN = 8  # Sections start at multiples of this offset
+
+
+def aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+class JsonCheckpoint:
+    """
+    The whole state as one JSON document. Simple, but loading it parses and
+    builds every object of the state before the master can serve.
+    """
+
+    filename = "checkpoint.json"
+
+    def dump(self, f, generation, state):
+        f.write(json.dumps({"generation": generation, "state": state}).encode())
+
+    def load(self, path):
+        with open(path, "r") as f:
+            checkpoint = json.load(f)
+        return checkpoint["generation"], checkpoint["state"]
+
+
+class BinaryCheckpoint:
+    """
+    Master metadata as raw arrays behind a small JSON header.
+
+    The chunk table's packed replica arrays and the file map, flattened to
+    name lengths, names, per-file chunk counts and one array of chunk ids,
+    are written as aligned sections. Loading maps the file and copies each
+    section into its array in one step instead of parsing millions of JSON
+    values, and the chunk table builds its per-server index only when it
+    is first needed.
+
+    state holds "file_to_chunks", "file_chunk_sizes", "chunk_size",
+    "directories", "next_chunk_id" and a ChunkTable under "chunk_locations". The master
+    checkpoints the table without replica locations, which it rebuilds
+    from chunkserver reports.
+    """
+
+    filename = "checkpoint.bin"
+
+    def dump(self, f, generation, state):
+        table = state["chunk_locations"]
+        files = state["file_to_chunks"]
+        names = [name.encode() for name in files]
+        file_chunks = array("q")
+        for chunk_ids in files.values():
+            file_chunks.extend(chunk_ids)
+
+        sections = {
+            "counts": table.counts,
+            "replicas": table.replicas,
+            "name_lengths": array("I", map(len, names)),
+            "names": b"".join(names),
+            "chunk_counts": array("I", map(len, files.values())),
+            "file_chunks": file_chunks,
+        }
+        layout = {}
+        offset = 0
+        for name, data in sections.items():
+            length = memoryview(data).nbytes
+            layout[name] = [offset, length]
+            offset = aligned(offset + length)
+
+        header = json.dumps(
+            {
+                "generation": generation,
+                "next_chunk_id": state["next_chunk_id"],
+                "directories": state["directories"],
+                "file_chunk_sizes": state.get("file_chunk_sizes", {}),
+                "chunk_size": state.get("chunk_size"),
+                "byteorder": sys.byteorder,
+                "slots": table.slots,
+                "servers": table.servers,
+                "overflow": table.overflow,
+                "shared": table.shared,
+                "sections": layout,
+            }
+        ).encode()
+
+        f.write(PREFIX.pack(MAGIC, len(header)))
+        f.write(header)
+        position = PREFIX.size + len(header)
+        base = aligned(position)
+        for name, data in sections.items():
+            start = base + layout[name][0]
+            f.write(bytes(start - position))
+            f.write(data)
+            position = start + layout[name][1]
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, header_length = PREFIX.unpack_from(mapped)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a binary checkpoint")
+            header = json.loads(mapped[PREFIX.size : PREFIX.size + header_length])
+            base = aligned(PREFIX.size + header_length)
+            swap = header["byteorder"] != sys.byteorder
+
+            def section(name, typecode=None):
+                offset, length = header["sections"][name]
+                with memoryview(mapped)[base + offset : base + offset + length] as data:
+                    if typecode is None:
+                        return bytearray(data)
+                    values = array(typecode)
+                    values.frombytes(data)
+                if swap:
+                    values.byteswap()
+                return values
+
+            table = ChunkTable.from_arrays(
+                header["slots"],
+                header["servers"],
+                section("counts"),
+                section("replicas", "H"),
+                header["overflow"],
+                header["shared"],
+            )
+
+            names = bytes(section("names"))
+            file_chunks = section("file_chunks", "q")
+            files = {}
+            name_start = chunk_start = 0
+            for name_length, num_chunks in zip(
+                section("name_lengths", "I"), section("chunk_counts", "I")
+            ):
+                name = names[name_start : name_start + name_length].decode()
+                files[name] = file_chunks[chunk_start : chunk_start + num_chunks].tolist()
+                name_start += name_length
+                chunk_start += num_chunks
+        finally:
+            mapped.close()
+
+        return header["generation"], {
+            "file_to_chunks": files,
+            "file_chunk_sizes": header.get("file_chunk_sizes", {}),
+            "chunk_size": header.get("chunk_size"),
+            "directories": header["directories"],
+            "chunk_locations": table,
+            "next_chunk_id": header["next_chunk_id"],
+        }
@@ -1,14 +1,30 @@
 import os
+import re
 import socket
 import threading
 import json
-import sys
 import time
+import shutil
+import argparse
+
+from metrics import Metrics, CountingSocket
+from tracing import Tracer, inject
+from protocol import send_message, send_file, recv_message, recv_sized_message, call
+
+CHUNK_FILE_PATTERN = re.compile(r"chunk_(\d+)\.dat$")
+REPLICA_FILE_PATTERN = re.compile(r"chunk_(\d+)_replica\.dat$")  # Older layout
 
 
 class ChunkServer:
     def __init__(
-        self, host, port, master_host, master_port, storage_dir="chunk_storage"
+        self,
+        host,
+        port,
+        master_host,
+        master_port,
+        storage_dir="chunk_storage",
+        metrics_port=None,
+        trace_dir=None,
     ):
         self.host = host
         self.port = port
@@ -16,17 +32,33 @@ class ChunkServer:
         self.master_port = master_port
         self.storage_dir = f"{storage_dir}_{port}"
         self.heartbeat_interval = 5  # seconds
+        self.chunk_report_interval = 30  # seconds
+        # Chunk inventory: full reports at registration and on request, deltas
+        # of the chunks written or deleted since on every heartbeat
+        self.inventory_lock = threading.Lock()
+        self.inventory_version = 0
+        self.changed_chunks = set()
+        self.max_delta_chunks = 1000  # Larger deltas make the master pull a full report
         self.request_count = 0
         self.request_count_lock = threading.Lock()
-        self.chunk_size = 12
+        self.chunk_size = 12  # Replaced by the master's setting at registration
+        self.metrics = Metrics("chunkserver")
+        self.metrics_port = metrics_port
+        self.tracer = Tracer(f"chunkserver-{port}", trace_dir)
         os.makedirs(self.storage_dir, exist_ok=True)
+        self.adopt_replica_files()
 
     def start(self):
+        if self.metrics_port is not None:
+            self.metrics.serve(self.host, self.metrics_port)
         self.register_with_master()
         threading.Thread(target=self.handle_master).start()
         # Thread for heartbeat
         threading.Thread(target=self.heartbeat).start()
+        # Thread for chunk reports, the master answers with garbage to delete
+        threading.Thread(target=self.report_chunks, daemon=True).start()
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server_socket.bind((self.host, self.port))
         server_socket.listen(5)
         print(f"Chunk Server started on {self.host}:{self.port}")
@@ -40,45 +72,47 @@ class ChunkServer:
         Function to handle dynamic replication tasks
         """
         master_listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        master_listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         master_listener.bind((self.host, self.port + 1))
-        master_listener.listen(1)  # Accept only one connection for master
+        master_listener.listen(5)
         # print(f"DEBUG: Listening for master connection on {self.host}:{self.port + 1}")
 
-        # Accept a single connection from master
-        conn, addr = master_listener.accept()
-        print(f"DEBUG: Connected to master at {addr}")
+        while True:
+            conn, addr = master_listener.accept()
+            print(f"DEBUG: Connected to master at {addr}")
+            threading.Thread(target=self.handle_master_connection, args=(conn,)).start()
 
+    def handle_master_connection(self, conn):
+        """
+        Serve framed replication requests from the master until it disconnects
+        """
         try:
-            buffer = b""
             while True:
-                chunk = conn.recv(1024)
-                if not chunk:
-                    continue
+                data = recv_message(conn)
+                if data is None:
+                    break
 
-                buffer += chunk
-
-                try:
-                    data = json.loads(buffer.decode())
-                    request = data.get("type")
-                    print(f"DEBUG: Received request from master: {request}")
-
-                    if request == "INCREASE_REPLICATION":
-                        chunk_id = data["chunk_id"]
-                        servers_without_replicas = data["available_servers"]
-                        resp = self.increase_replication(
-                            chunk_id,
-                            servers_without_replicas,
-                        )
-                        resp["server"] = (self.host, self.port)
-                        resp["type"] = "INCREASE_REPLICATION"
-                        resp["chunk_id"] = chunk_id
-
-                        conn.send(json.dumps(resp).encode())
-                        # print("DEBUG: Response sent to master.")
-
-                except json.JSONDecodeError:
-                    print("DEBUG: Invalid JSON received, ignoring...")
-                    continue
+                request = data.get("type")
+                print(f"DEBUG: Received request from master: {request}")
+
+                if request == "INCREASE_REPLICATION":
+                    chunk_id = data["chunk_id"]
+                    servers_without_replicas = data["available_servers"]
+                    resp = self.increase_replication(
+                        chunk_id,
+                        servers_without_replicas,
+                    )
+                    resp["server"] = (self.host, self.port)
+                    resp["type"] = "INCREASE_REPLICATION"
+                    resp["chunk_id"] = chunk_id
+
+                    send_message(conn, resp)
+                    # print("DEBUG: Response sent to master.")
+
+                elif request == "REPORT_CHUNKS":
+                    send_message(
+                        conn, {"status": "OK", "inventory": self.chunk_inventory()}
+                    )
 
         except Exception as e:
             print(f"Error handling master request: {e}")
@@ -94,12 +128,16 @@ class ChunkServer:
             try:
                 master_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
                 # print(f"Heartbeat: {self.request_count}")
+                disk = shutil.disk_usage(self.storage_dir)
                 with self.request_count_lock:
                     heartbeat_data = {
                         "type": "HEARTBEAT",
                         "chunk_server_id": str(self.host) + ":" + str(self.port),
                         "timestamp": time.time(),
                         "num_requests": self.request_count,
+                        "free_bytes": disk.free,
+                        "capacity_bytes": disk.total,
+                        "inventory": self.inventory_delta(),
                     }
                     master_socket.sendto(
                         json.dumps(heartbeat_data).encode(),
@@ -115,18 +153,164 @@ class ChunkServer:
                 # Sleep for 5 seconds before sending the next heartbeat
                 time.sleep(5)
 
+    def chunk_path(self, chunk_id):
+        # Every replica of a chunk uses the same file name, the primary is
+        # whichever location the master lists first and may change
+        return os.path.join(self.storage_dir, f"chunk_{chunk_id}.dat")
+
+    def adopt_replica_files(self):
+        """
+        Rename the chunk_N_replica.dat files of the older layout, which named
+        files after the server's role, to the shared chunk file name. Where
+        both exist the primary copy is kept, reads served it first.
+        """
+        for name in os.listdir(self.storage_dir):
+            match = REPLICA_FILE_PATTERN.match(name)
+            if not match:
+                continue
+            source = os.path.join(self.storage_dir, name)
+            target = self.chunk_path(int(match.group(1)))
+            if os.path.exists(target):
+                os.remove(source)
+            else:
+                os.rename(source, target)
+
+    def list_chunks(self):
+        """
+        Sizes of the chunks stored on this server by chunk id.
+        """
+        sizes = {}
+        with os.scandir(self.storage_dir) as entries:
+            for entry in entries:
+                match = CHUNK_FILE_PATTERN.match(entry.name)
+                if match:
+                    sizes[int(match.group(1))] = entry.stat().st_size
+        return sizes
+
+    def stored_size(self, chunk_id):
+        """Size of a stored chunk, or None if this server does not hold it."""
+        path = self.chunk_path(chunk_id)
+        if os.path.exists(path):
+            return os.path.getsize(path)
+        return None
+
+    def chunk_changed(self, chunk_id):
+        with self.inventory_lock:
+            self.changed_chunks.add(chunk_id)
+
+    def chunk_inventory(self):
+        """
+        Full inventory of the stored chunks as parallel id and size lists.
+        """
+        with self.inventory_lock:
+            self.changed_chunks.clear()
+            self.inventory_version += 1
+            sizes = self.list_chunks()
+            chunk_ids = sorted(sizes)
+            return {
+                "version": self.inventory_version,
+                "chunk_ids": chunk_ids,
+                "sizes": [sizes[chunk_id] for chunk_id in chunk_ids],
+            }
+
+    def inventory_delta(self):
+        """
+        Chunks added or removed since the last report, relative to inventory
+        version base. Too large a delta is sent without its changes.
+        """
+        with self.inventory_lock:
+            changed, self.changed_chunks = self.changed_chunks, set()
+            base = self.inventory_version
+            if not changed:
+                return {"base": base, "version": base}
+            self.inventory_version += 1
+            if len(changed) > self.max_delta_chunks:
+                return {"base": None, "version": self.inventory_version}
+
+            added = []
+            removed = []
+            for chunk_id in sorted(changed):
+                size = self.stored_size(chunk_id)
+                if size is None:
+                    removed.append(chunk_id)
+                else:
+                    added.append([chunk_id, size])
+            return {
+                "base": base,
+                "version": self.inventory_version,
+                "added": added,
+                "removed": removed,
+            }
+
+    def delete_garbage(self, chunk_ids):
+        freed_bytes = 0
+        for chunk_id in chunk_ids:
+            freed_bytes += self.delete_chunk_files(chunk_id)[1]
+        if chunk_ids:
+            print(f"GC: Deleted {len(chunk_ids)} chunks, freed {freed_bytes} bytes")
+
+    def report_chunks(self):
+        """
+        Periodically send the chunk inventory to the master and delete the
+        chunks it no longer references.
+        """
+        while True:
+            time.sleep(self.chunk_report_interval)
+            try:
+                response = call(
+                    (self.master_host, self.master_port),
+                    {
+                        "type": "CHUNK_REPORT",
+                        "chunk_server_id": str(self.host) + ":" + str(self.port),
+                        "inventory": self.chunk_inventory(),
+                    },
+                )
+                if response.get("status") != "OK":
+                    print(f"Chunk report rejected: {response.get('message')}")
+                    continue
+                self.delete_garbage(response.get("garbage", []))
+            except Exception as e:
+                print(f"Error sending chunk report to master: {e}")
+
     def register_with_master(self):
         master_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         master_socket.connect((self.master_host, self.master_port))
-        master_socket.send(
-            json.dumps(
-                {"type": "REGISTER_CHUNKSERVER", "address": (self.host, self.port)}
-            ).encode()
+        send_message(
+            master_socket,
+            {
+                "type": "REGISTER_CHUNKSERVER",
+                "address": (self.host, self.port),
+                "inventory": self.chunk_inventory(),
+            },
         )
+        response = recv_message(master_socket)
         master_socket.close()
+        # Chunk size of files without their own, chosen by the master
+        self.chunk_size = response.get("chunk_size", self.chunk_size)
+        self.delete_garbage(response.get("garbage", []))
 
     def handle_client(self, client_socket):
-        data = json.loads(client_socket.recv(1024))
+        data, received = recv_sized_message(client_socket)
+        if data is None:
+            client_socket.close()
+            return
+        start = time.perf_counter()
+        request = data.get("type")
+        client_socket = CountingSocket(client_socket)
+        try:
+            with self.tracer.span(
+                request, data.get("trace"), chunk_id=data.get("chunk_id")
+            ):
+                self.dispatch(client_socket, data)
+        finally:
+            self.metrics.observe_request(
+                request,
+                time.perf_counter() - start,
+                received,
+                client_socket.bytes_sent,
+            )
+
+    def dispatch(self, client_socket, data):
         request = data.get("type")
 
         with self.request_count_lock:
@@ -143,11 +327,20 @@ class ChunkServer:
         elif request == "DELETE_CHUNK":
             chunk_id = data["chunk_id"]
             self.handle_delete_chunk(client_socket, chunk_id)
+        elif request == "COPY_CHUNK":
+            self.handle_copy_chunk(client_socket, data["chunk_id"], data["new_chunk_id"])
         elif request == "APPEND":
             chunk_id = data["chunk_id"]
             content = data["content"]
             secondary_servers = data.get("secondary_servers", [])
-            self.handle_append(client_socket, chunk_id, content, secondary_servers)
+            self.handle_append(
+                client_socket,
+                chunk_id,
+                content,
+                secondary_servers,
+                data.get("chunk_size", self.chunk_size),
+                data.get("forwarded", False),
+            )
         elif request == "WRITE_OFFSET":
             chunk_id = data["chunk_id"]
             content = data["content"]
@@ -165,172 +358,130 @@ class ChunkServer:
                 self.request_count -= 1
 
     def get_chunk_size(self, client_socket, chunk_id):
-
-        primary_chunk_file = os.path.join(self.storage_dir, f"chunk_{chunk_id}.dat")
-        replica_chunk_file = os.path.join(
-            self.storage_dir, f"chunk_{chunk_id}_replica.dat"
-        )
-
-        if os.path.exists(primary_chunk_file):
-            chunk_size = os.path.getsize(
-                primary_chunk_file
-            )  # Get the size of the chunk file
-            response = {"status": "OK", "chunk_size": chunk_size}
-        elif os.path.exists(replica_chunk_file):
-            chunk_size = os.path.getsize(
-                replica_chunk_file
-            )  # Get the size of the chunk file
+        chunk_size = self.stored_size(chunk_id)
+        if chunk_size is not None:
             response = {"status": "OK", "chunk_size": chunk_size}
         else:
             response = {"status": "Error", "message": "Chunk file not found"}
-        client_socket.send(json.dumps(response).encode())
-
-    def handle_append(self, client_socket, chunk_id, content, secondary_servers):
+        send_message(client_socket, response)
 
-        if len(secondary_servers) == 2:
-            chunk_file = os.path.join(self.storage_dir, f"chunk_{chunk_id}.dat")
-        elif len(secondary_servers) == 0:
-            chunk_file = chunk_file = os.path.join(
-                self.storage_dir, f"chunk_{chunk_id}_replica.dat"
-            )
+    def handle_append(
+        self, client_socket, chunk_id, content, secondary_servers, chunk_size, forwarded
+    ):
+        # The primary decides where records go, secondaries repeat its appends
+        chunk_file = self.chunk_path(chunk_id)
 
-        with open(chunk_file, "a+") as f:
+        start = time.perf_counter()
+        with open(chunk_file, "ab") as f:
             f.seek(0, os.SEEK_END)
             current_size = f.tell()
 
-            if (
-                len(secondary_servers) == 0
-                or current_size + len(content) > self.chunk_size
-            ):
-                remaining_space = self.chunk_size - current_size
-                f.write("%" * remaining_space)  # Pad with '%'
-                if len(secondary_servers) == 2:
-                    self.send_padding_to_secondary(
-                        secondary_servers, chunk_id, remaining_space
-                    )
-                    response = {
-                        "status": "Insufficient Space",
-                        "message": "Need new chunk",
-                    }
-                elif len(secondary_servers) == 0:
-                    response = {"status": "Replica Padded", "message": "replica padded"}
-
+            if forwarded:
+                f.write(content)  # Record placed by the primary
+                response = {"status": "OK", "message": "Data appended"}
+            elif current_size + len(content) > chunk_size:
+                # Leave the chunk short, the retry puts the record in a new one
+                response = {
+                    "status": "Insufficient Space",
+                    "message": "Need new chunk",
+                }
             else:
                 f.write(content)
-                if len(secondary_servers) == 2:
-                    self.replicate_append_to_secondary(
-                        secondary_servers, chunk_id, content
-                    )
+                self.replicate_append_to_secondary(
+                    secondary_servers, chunk_id, content
+                )
 
                 response = {"status": "OK", "message": "Data appended"}
+            size = f.tell() - current_size
+        self.metrics.observe_disk("append", time.perf_counter() - start, size)
 
-        client_socket.send(json.dumps(response).encode())
-
-    def send_padding_to_secondary(self, replicas, chunk_id, padding_length):
-        if not replicas:
-            return
-
-        for server in replicas:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect(tuple(server))
-                request = {
-                    "type": "APPEND",
-                    "chunk_id": chunk_id,
-                    "content": "%" * padding_length,
-                    "secondary_servers": [],
-                }
-                s.send(json.dumps(request).encode())
-                s.recv(1024)
+        if size:
+            self.chunk_changed(chunk_id)
+        send_message(client_socket, response)
 
     def replicate_append_to_secondary(self, replicas, chunk_id, content):
         if not replicas:
             return
 
         for server in replicas:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            with self.tracer.span(
+                "forward", server="%s:%s" % tuple(server)
+            ), socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
                 s.connect(tuple(server))
                 request = {
                     "type": "APPEND",
                     "chunk_id": chunk_id,
                     "content": content,
                     "secondary_servers": [],
+                    "forwarded": True,
                 }
-                s.send(json.dumps(request).encode())
-                s.recv(1024)
+                send_message(s, inject(request))
+                recv_message(s)
 
     def handle_read(self, client_socket, chunk_id):
-        # Paths for primary chunk and replica chunk
-        primary_chunk_file = os.path.join(self.storage_dir, f"chunk_{chunk_id}.dat")
-        replica_chunk_file = os.path.join(
-            self.storage_dir, f"chunk_{chunk_id}_replica.dat"
-        )
-
-        # Try to read the primary chunk file first
-        if os.path.exists(primary_chunk_file):
-            with open(primary_chunk_file, "r") as f:
-                content = f.read()
-                response = {"status": "OK", "content": content}
-        # If primary chunk is not found, try the replica
-        elif os.path.exists(replica_chunk_file):
-            with open(replica_chunk_file, "r") as f:
-                content = f.read()
-                response = {"status": "OK", "content": content}
-        else:
-            # Neither primary nor replica chunk file was found
-            response = {"status": "Error", "message": "Chunk not found"}
-
-        # Send the response to the client
-        # print(f"here {response}")
-        client_socket.send(json.dumps(response).encode())
-        client_socket.close()
+        try:
+            try:
+                f = open(self.chunk_path(chunk_id), "rb")
+            except FileNotFoundError:
+                response = {"status": "Error", "message": "Chunk not found"}
+                send_message(client_socket, response)
+                return
+            with f:
+                # Stream the chunk from the page cache, the size is fixed by
+                # the header so bytes appended meanwhile wait for the next read
+                size = os.fstat(f.fileno()).st_size
+                start = time.perf_counter()
+                send_file(client_socket, {"status": "OK"}, f, size)
+                # Includes the time the socket takes to accept the data
+                self.metrics.observe_disk("read", time.perf_counter() - start, size)
+        finally:
+            client_socket.close()
 
     def handle_write(self, client_socket, chunk_id, content, replicas):
-        # For the primary server, store as chunk_{chunk_id}.dat
-        if len(replicas) == 3:  # Primary server
-            chunk_file = os.path.join(self.storage_dir, f"chunk_{chunk_id}.dat")
-        elif (
-            len(replicas) == 0
-        ):  # For secondary (replica) servers, store as chunk_{chunk_id}_replica.dat
-            chunk_file = os.path.join(self.storage_dir, f"chunk_{chunk_id}_replica.dat")
+        # The primary gets every location of the chunk, itself included
+        chunk_file = self.chunk_path(chunk_id)
 
-        with open(chunk_file, "w") as f:
-            f.write(content)
+        with self.metrics.timed_disk("write", len(content)):
+            with open(chunk_file, "wb") as f:
+                f.write(content)
+        self.chunk_changed(chunk_id)
 
         # Replicate to secondary servers if on the primary
-        if len(replicas) == 3:
+        if replicas:
             self.replicate_to_secondary_servers(chunk_id, content, replicas)
 
         # Acknowledge the client that data was written
         response = {"status": "OK", "message": "Chunk data written"}
-        client_socket.send(json.dumps(response).encode())
+        send_message(client_socket, response)
 
     def handle_write_offset(
         self, client_socket, chunk_id, content, chunk_offset, replicas
     ):
-        if len(replicas) == 3:  # Primary server
-            chunk_file = os.path.join(self.storage_dir, f"chunk_{chunk_id}.dat")
-        elif (
-            len(replicas) == 0
-        ):  # For secondary (replica) servers, store as chunk_{chunk_id}_replica.dat
-            chunk_file = os.path.join(self.storage_dir, f"chunk_{chunk_id}_replica.dat")
+        # The primary gets every location of the chunk, itself included
+        chunk_file = self.chunk_path(chunk_id)
         # Read existing data and overwrite from the offset
         # print(f"here {len(replicas)}")
-        existing_data = ""
+        start = time.perf_counter()
+        existing_data = b""
         if os.path.exists(chunk_file):
-            with open(chunk_file, "r") as f:
+            with open(chunk_file, "rb") as f:
                 existing_data = f.read()
 
         # Combine existing data with new content
         updated_data = existing_data[:chunk_offset] + content
-        with open(chunk_file, "w") as f:
+        with open(chunk_file, "wb") as f:
             f.write(updated_data)
+        self.metrics.observe_disk(
+            "write_offset", time.perf_counter() - start, len(updated_data)
+        )
+        self.chunk_changed(chunk_id)
 
-        if len(replicas) == 3:
+        if replicas:
             self.replicate_to_secondary_servers(chunk_id, updated_data, replicas)
 
         # Acknowledge the client
         response = {"status": "OK", "message": "Offset write completed"}
-        client_socket.send(json.dumps(response).encode())
+        send_message(client_socket, response)
 
     def replicate_to_secondary_servers(self, chunk_id, content, replicas):
         if not replicas:
@@ -338,7 +489,9 @@ class ChunkServer:
             return
 
         for server in replicas[1:]:  # Skip the primary server
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            with self.tracer.span(
+                "forward", server="%s:%s" % tuple(server)
+            ), socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
                 s.connect(tuple(server))
                 request = {
                     "type": "WRITE",
@@ -346,36 +499,70 @@ class ChunkServer:
                     "content": content,
                     "replicas": [],  # No replicas needed for replication; secondary server will handle it
                 }
-                s.send(json.dumps(request).encode())
-                s.recv(1024)  # Await acknowledgment from secondary servers
+                send_message(s, inject(request))
+                recv_message(s)  # Await acknowledgment from secondary servers
 
     def handle_delete_chunk(self, client_socket, chunk_id):
         """Delete chunk data from the chunk server."""
-        chunk_file = os.path.join(self.storage_dir, f"chunk_{chunk_id}.dat")
-        chunk_replica_file = os.path.join(
-            self.storage_dir, f"chunk_{chunk_id}_replica.dat"
-        )
+        deleted, freed_bytes = self.delete_chunk_files(chunk_id)
+
+        # Send response back to the client
+        if deleted:
+            response = {
+                "status": "OK",
+                "message": f"Chunk {chunk_id} deleted",
+                "bytes": freed_bytes,
+            }
+        else:
+            response = {"status": "Error", "message": f"Chunk {chunk_id} not found"}
+
+        send_message(client_socket, response)
+        client_socket.close()
+
+    def handle_copy_chunk(self, client_socket, chunk_id, new_chunk_id):
+        """
+        Copy a chunk to a new id on this server, used when a write hits a
+        chunk shared with a snapshot.
+        """
+        source = self.chunk_path(chunk_id)
+        copied = os.path.exists(source)
+        if copied:
+            with self.metrics.timed_disk("copy", os.path.getsize(source)):
+                shutil.copyfile(source, self.chunk_path(new_chunk_id))
+            self.chunk_changed(new_chunk_id)
+
+        if copied:
+            response = {
+                "status": "OK",
+                "message": f"Chunk {chunk_id} copied to {new_chunk_id}",
+            }
+        else:
+            response = {"status": "Error", "message": f"Chunk {chunk_id} not found"}
+
+        send_message(client_socket, response)
+        client_socket.close()
+
+    def delete_chunk_files(self, chunk_id):
+        """
+        Remove the file of a chunk.
+        Returns whether anything was deleted and the bytes freed.
+        """
+        chunk_file = self.chunk_path(chunk_id)
 
         deleted = False
+        freed_bytes = 0
+        start = time.perf_counter()
 
         if os.path.exists(chunk_file):
+            freed_bytes += os.path.getsize(chunk_file)
             os.remove(chunk_file)
             deleted = True
             print(f"Deleted chunk {chunk_id} from {self.storage_dir}")
 
-        if os.path.exists(chunk_replica_file):
-            os.remove(chunk_replica_file)
-            deleted = True
-            print(f"Deleted replica chunk {chunk_id} from {self.storage_dir}")
-
-        # Send response back to the client
         if deleted:
-            response = {"status": "OK", "message": f"Chunk {chunk_id} deleted"}
-        else:
-            response = {"status": "Error", "message": f"Chunk {chunk_id} not found"}
-
-        client_socket.send(json.dumps(response).encode())
-        client_socket.close()
+            self.metrics.observe_disk("delete", time.perf_counter() - start, freed_bytes)
+            self.chunk_changed(chunk_id)
+        return deleted, freed_bytes
 
     def increase_replication(self, chunk_id, servers_without_replicas):
         """
@@ -386,11 +573,7 @@ class ChunkServer:
         )
 
         # Read the chunk data from the current server (could be primary or replica)
-        chunk_file = os.path.join(self.storage_dir, f"chunk_{chunk_id}.dat")
-        if not os.path.exists(chunk_file):
-            print(f"DEBUG: Checking for replica")
-            chunk_file = os.path.join(self.storage_dir, f"chunk_{chunk_id}_replica.dat")
-
+        chunk_file = self.chunk_path(chunk_id)
         if not os.path.exists(chunk_file):
             print(f"Chunk file {chunk_file} not found on server")
             return {
@@ -399,7 +582,7 @@ class ChunkServer:
                 "server": (self.host, self.port),
             }
 
-        with open(chunk_file, "r") as f:
+        with open(chunk_file, "rb") as f:
             content = f.read()
 
         # print(
@@ -422,11 +605,11 @@ class ChunkServer:
                     "replicas": [],
                 }
                 # print(f"DEBUG: Sending request to {server}: {request}")
-                s.send(json.dumps(request).encode())
+                send_message(s, request)
                 # print(f"DEBUG: Waiting for response from {server}")
-                response = s.recv(1024)
+                response = recv_message(s)
                 # print(f"DEBUG: Received response from {server}: {response}")
-                if json.loads(response).get("status") == "OK":
+                if response.get("status") == "OK":
                     print(
                         f"DEBUG: Successfully replicated chunk {chunk_id} to {server}"
                     )
@@ -453,11 +636,26 @@ class ChunkServer:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GFS chunk server")
+    parser.add_argument("port", type=int)
+    parser.add_argument(
+        "metrics_port",
+        type=int,
+        nargs="?",
+        help="Port of the HTTP /metrics endpoint",
+    )
+    parser.add_argument("--master-host", default="127.0.0.1")
+    parser.add_argument("--master-port", type=int, default=5000)
+    parser.add_argument("--trace-dir", help="Write spans of traced requests here")
+    args = parser.parse_args()
+
     chunkserver_host = "127.0.0.1"
-    chunkserver_port = int(sys.argv[1])
-    master_host = "127.0.0.1"
-    master_port = 5000
     chunkserver = ChunkServer(
-        chunkserver_host, chunkserver_port, master_host, master_port
+        chunkserver_host,
+        args.port,
+        args.master_host,
+        args.master_port,
+        metrics_port=args.metrics_port,
+        trace_dir=args.trace_dir,
     )
     chunkserver.start()
@@ -0,0 +1,237 @@
+from array import array
+
+ABSENT = 0xFF  # Replica count marking a chunk id that is not in the table
+NO_REPLICAS = bytes(ABSENT if count == ABSENT else 0 for count in range(256))
+
+
+class ChunkTable:
+    """
+    Compact map from integer chunk id to its replica servers.
+
+    Server addresses are interned into a small table and each chunk id
+    indexes a fixed-width row of server indexes in a packed array, so a
+    chunk costs a few bytes instead of a dict entry plus nested lists.
+    Replicas beyond the row width spill into a small overflow dict.
+    Lookups return servers as [host, port] lists, like the JSON metadata.
+
+    Chunks shared by snapshots carry a reference count. Only counts above
+    one are stored, a chunk in the table is otherwise referenced once.
+    """
+
+    def __init__(self, slots=4):
+        self.slots = slots  # Replicas stored inline per chunk
+        self.servers = []  # Server index -> (host, port)
+        self.server_index = {}  # "host:port" -> server index
+        self.counts = bytearray()  # Chunk id -> replica count, ABSENT if unused
+        self.replicas = array("H")  # Chunk id * slots -> server index
+        self.overflow = {}  # Chunk id -> server indexes beyond the inline slots
+        self.shared = {}  # Chunk id -> file references, only when more than one
+        self.size = 0
+
+        # Reverse index: server index -> chunk ids ever placed there. Removals
+        # are lazy, stale ids are filtered on lookup and compacted in bulk.
+        # Tables loaded from packed arrays build it on first use.
+        self.server_chunks = []
+        self.server_stale = []
+        self.indexed = True
+
+    @classmethod
+    def from_arrays(cls, slots, servers, counts, replicas, overflow, shared):
+        """
+        Build a table around packed arrays, e.g. read from a checkpoint.
+        counts and replicas are used as is, not copied.
+        """
+        table = cls(slots)
+        for server in servers:
+            table.intern_server(server)
+        table.counts = counts
+        table.replicas = replicas
+        table.overflow = {int(chunk_id): list(extra) for chunk_id, extra in overflow.items()}
+        table.shared = {int(chunk_id): refs for chunk_id, refs in shared.items()}
+        table.size = len(counts) - counts.count(ABSENT)
+        table.indexed = False
+        return table
+
+    def copy(self, locations=True):
+        """
+        Copy the table, or only its chunk ids and reference counts with every
+        chunk left without replicas.
+        """
+        if not locations:
+            return ChunkTable.from_arrays(
+                self.slots, [], self.counts.translate(NO_REPLICAS), array("H"), {}, self.shared
+            )
+        return ChunkTable.from_arrays(
+            self.slots,
+            self.servers,
+            bytearray(self.counts),
+            array("H", self.replicas),
+            self.overflow,
+            self.shared,
+        )
+
+    def intern_server(self, server):
+        server_id = f"{server[0]}:{server[1]}"
+        index = self.server_index.get(server_id)
+        if index is None:
+            index = len(self.servers)
+            self.servers.append((server[0], int(server[1])))
+            self.server_index[server_id] = index
+            self.server_chunks.append(array("q"))
+            self.server_stale.append(0)
+        return index
+
+    def row(self, chunk_id):
+        """Return the server indexes of a chunk, or None if it is absent."""
+        if chunk_id < 0 or chunk_id >= len(self.counts):
+            return None
+        count = self.counts[chunk_id]
+        if count == ABSENT:
+            return None
+        start = chunk_id * self.slots
+        indexes = list(self.replicas[start : start + min(count, self.slots)])
+        if count > self.slots:
+            indexes.extend(self.overflow[chunk_id])
+        return indexes
+
+    def __contains__(self, chunk_id):
+        return self.row(int(chunk_id)) is not None
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        counts = self.counts
+        return (chunk_id for chunk_id in range(len(counts)) if counts[chunk_id] != ABSENT)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for chunk_id in self:
+            yield chunk_id, self[chunk_id]
+
+    def __getitem__(self, chunk_id):
+        indexes = self.row(int(chunk_id))
+        if indexes is None:
+            raise KeyError(chunk_id)
+        return [list(self.servers[index]) for index in indexes]
+
+    def get(self, chunk_id, default=None):
+        try:
+            return self[chunk_id]
+        except KeyError:
+            return default
+
+    def __setitem__(self, chunk_id, servers):
+        chunk_id = int(chunk_id)
+        if len(servers) >= ABSENT:
+            raise ValueError(f"Too many replicas for chunk {chunk_id}")
+
+        old_indexes = self.row(chunk_id)
+        if old_indexes is None:
+            self.size += 1
+            old_indexes = []
+        indexes = [self.intern_server(server) for server in servers]
+
+        # Grow the dense arrays up to this chunk id. Tables loaded without
+        # locations grow their replica array only as replicas are reported.
+        missing = chunk_id + 1 - len(self.counts)
+        if missing > 0:
+            self.counts.extend(bytes([ABSENT]) * missing)
+        missing = (chunk_id + 1) * self.slots - len(self.replicas)
+        if missing > 0 and indexes:
+            self.replicas.extend(array("H", bytes(2 * missing)))
+
+        start = chunk_id * self.slots
+        for slot, index in enumerate(indexes[: self.slots]):
+            self.replicas[start + slot] = index
+        if len(indexes) > self.slots:
+            self.overflow[chunk_id] = indexes[self.slots :]
+        else:
+            self.overflow.pop(chunk_id, None)
+        self.counts[chunk_id] = len(indexes)
+
+        self.reindex(chunk_id, old_indexes, indexes)
+
+    def pop(self, chunk_id, *default):
+        chunk_id = int(chunk_id)
+        indexes = self.row(chunk_id)
+        if indexes is None:
+            if default:
+                return default[0]
+            raise KeyError(chunk_id)
+
+        servers = [list(self.servers[index]) for index in indexes]
+        self.counts[chunk_id] = ABSENT
+        self.overflow.pop(chunk_id, None)
+        self.shared.pop(chunk_id, None)
+        self.size -= 1
+        self.reindex(chunk_id, indexes, [])
+        return servers
+
+    def refcount(self, chunk_id):
+        if chunk_id not in self:
+            return 0
+        return self.shared.get(chunk_id, 1)
+
+    def add_ref(self, chunk_id):
+        self.shared[chunk_id] = self.shared.get(chunk_id, 1) + 1
+
+    def drop_ref(self, chunk_id):
+        """Release one reference. Returns True if the chunk is still referenced."""
+        refs = self.shared.pop(chunk_id, 1) - 1
+        if refs > 1:
+            self.shared[chunk_id] = refs
+        return refs > 0
+
+    def build_index(self):
+        self.server_chunks = [array("q") for _ in self.servers]
+        self.server_stale = [0] * len(self.servers)
+        for chunk_id in self:
+            for index in set(self.row(chunk_id)):
+                self.server_chunks[index].append(chunk_id)
+        self.indexed = True
+
+    def reindex(self, chunk_id, old_indexes, new_indexes):
+        if not self.indexed:
+            return
+        for index in set(old_indexes) - set(new_indexes):
+            self.server_stale[index] += 1
+            if self.server_stale[index] > len(self.server_chunks[index]) // 2:
+                self.compact_server(index)
+        for index in set(new_indexes) - set(old_indexes):
+            self.server_chunks[index].append(chunk_id)
+
+    def compact_server(self, index):
+        self.server_chunks[index] = array("q", self.live_chunks(index))
+        self.server_stale[index] = 0
+
+    def live_chunks(self, index):
+        live = set()
+        for chunk_id in self.server_chunks[index]:
+            indexes = self.row(chunk_id)
+            if indexes is not None and index in indexes:
+                live.add(chunk_id)
+        return sorted(live)
+
+    def chunks_on(self, server_id):
+        """Return the chunk ids currently hosted by a "host:port" server id."""
+        index = self.server_index.get(server_id)
+        if index is None:
+            return []
+        if not self.indexed:
+            self.build_index()
+        return self.live_chunks(index)
+
+    def to_dict(self):
+        return {chunk_id: servers for chunk_id, servers in self.items()}
+
+    def memory_usage(self):
+        """Approximate bytes held by the packed arrays and overflow entries."""
+        return (
+            len(self.counts)
+            + self.replicas.itemsize * len(self.replicas)
+            + sum(chunks.itemsize * len(chunks) for chunks in self.server_chunks)
+            + sum(8 * (len(extra) + 8) for extra in self.overflow.values())
+        )
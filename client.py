@@ -1,23 +1,62 @@
 import socket
-import json
 import sys
 import os
+import random
+
+from location_cache import LocationCache
+from protocol import send_message, recv_message, call
+from tracing import Tracer, inject, traced
+
+
+def as_bytes(data):
+    """File data goes over the wire as bytes, text is stored as UTF-8."""
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    return data
 
 
 class Client:
-    def __init__(self, master_host, master_port):
+    def __init__(
+        self,
+        master_host,
+        master_port,
+        cache_ttl=30,
+        cache_size=10000,
+        shadows=(),
+        trace_dir=None,
+    ):
         self.master_host = master_host
         self.master_port = master_port
-        self.chunk_size = 12
-
+        self.shadows = list(shadows)  # (host, port) of shadow masters for lookups
+        self.config = None  # Cluster settings, fetched from the master on first use
+        self.location_cache = LocationCache(ttl=cache_ttl, max_entries=cache_size)
+        # Every operation starts a trace when trace_dir is set
+        self.tracer = Tracer("client", trace_dir)
+
+    @property
+    def chunk_size(self):
+        """Default chunk size of the cluster. Files may use their own."""
+        if self.config is None:
+            response = call((self.master_host, self.master_port), {"type": "CONFIG"})
+            if response.get("status") != "OK":
+                raise ConnectionError(f"Master refused CONFIG: {response}")
+            self.config = response
+        return self.config["chunk_size"]
+
+    def cache_stats(self):
+        """Hit, miss, eviction and invalidation counters of the location cache"""
+        return self.location_cache.stats()
+
+    @traced("delete")
     def delete(self, filename):
         print("Deleting file: ", filename)
+        self.location_cache.invalidate(filename)
         request = {"type": "DELETE", "filename": filename}
 
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect((self.master_host, self.master_port))
-            s.send(json.dumps(request).encode())
-            response = json.loads(s.recv(1024))
+            send_message(s, inject(request))
+            response = recv_message(s)
 
         # Check if the response contains an error message
         if response.get("status") != "OK":
@@ -25,36 +64,140 @@ class Client:
             return
         print(f"{response.get('message')}")
 
-    def read(self, filename):
-        print("Reading file:", filename)
-        request = {"type": "READ", "filename": filename}
+    def metadata_lookup(self, request, use_shadow=True):
+        """
+        Send a metadata read to a random shadow master, or to the master if
+        there are none, the shadow fails or it answers with an error. A
+        shadow may not have seen the latest mutations yet.
+        Returns (response, from_shadow).
+        """
+        if use_shadow and self.shadows:
+            shadow = random.choice(self.shadows)
+            try:
+                response = call(shadow, inject(request))
+                if response and response.get("status") == "OK":
+                    return response, True
+            except OSError as e:
+                print(f"Shadow master {shadow} unavailable: {e}")
+
+        return call((self.master_host, self.master_port), inject(request)), False
+
+    def lookup_file(self, filename, use_cache=True):
+        """
+        Return (chunk_ids, locations, maybe_stale) for a file, or None if the
+        master reports an error. With use_cache the answer may come from the
+        location cache or a shadow master, otherwise the master is asked.
+        """
+        if use_cache:
+            cached = self.location_cache.get_file(filename)
+            if cached is not None:
+                return cached[0], cached[1], True
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((self.master_host, self.master_port))
-            s.send(json.dumps(request).encode())
-            response = json.loads(s.recv(1024))
+        request = {"type": "READ", "filename": filename}
+        response, from_shadow = self.metadata_lookup(request, use_cache)
 
         # Check if the response contains an error message
         if response.get("status") != "OK":
             print("Error:", response.get("message", "Unknown error"))
-            return
+            return None
+
+        self.location_cache.put_file(
+            filename, response["chunks"], response["locations"]
+        )
+        return response["chunks"], response["locations"], from_shadow
+
+    def lookup_many(self, files):
+        """
+        Resolve many files, or chunk index ranges of files, in one metadata
+        round trip. Each entry is a filename or a (filename, start, end) tuple.
+        Returns {filename: (chunk_ids, locations)} for the files that exist and
+        fills the location cache with the results.
+        """
+        entries = []
+        for entry in files:
+            if isinstance(entry, str):
+                entries.append({"filename": entry})
+            else:
+                filename, start, end = entry
+                entries.append({"filename": filename, "start": start, "end": end})
+
+        response, _ = self.metadata_lookup({"type": "BATCH_LOOKUP", "files": entries})
 
-        print("File found, retrieving chunks...")
-        download_dir = "client_files"   
-        os.makedirs(download_dir, exist_ok=True)
+        if response.get("status") != "OK":
+            print("Error:", response.get("message", "Unknown error"))
+            return {}
+
+        found = {}
+        for result in response["results"]:
+            if result.get("status") != "OK":
+                print(f"Error: {result['filename']}: {result['status']}")
+                continue
+            self.location_cache.put_chunks(
+                result["filename"],
+                result["start"],
+                result["num_chunks"],
+                result["chunks"],
+                result["locations"],
+            )
+            found[result["filename"]] = (result["chunks"], result["locations"])
+        return found
+
+    @traced("read_many")
+    def read_many(self, filenames):
+        """
+        Read several files, resolving all uncached locations in one batch.
+        """
+        missing = [
+            filename
+            for filename in filenames
+            if self.location_cache.get_file(filename) is None
+        ]
+        if missing:
+            self.lookup_many(missing)
+        for filename in filenames:
+            self.read(filename)
+
+    @traced("read")
+    def read(self, filename):
+        print("Reading file:", filename)
+        download_dir = "client_files"
+        local_path = os.path.join(download_dir, filename.strip("/"))
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+
+        # Try cached or shadow locations first and fall back to the master if they are stale
+        for use_cache in (True, False):
+            lookup = self.lookup_file(filename, use_cache)
+            if lookup is None:
+                return
+            chunk_ids, locations, maybe_stale = lookup
+
+            print("File found, retrieving chunks...")
+            complete = True
+
+            # Open a file in write mode to store the content of the chunks
+            with open(local_path, "wb") as file:
+                for index, (chunk_id, servers) in enumerate(zip(chunk_ids, locations)):
+                    found, stale = self.retrieve_chunk_data(chunk_id, servers, file)
+                    if stale:
+                        self.location_cache.invalidate(filename, index)
+                    complete = complete and found
+
+            if complete or not maybe_stale:
+                break
+            print("Chunk locations are stale, asking the master...")
 
-        # Open a file in write mode to store the content of the chunks
-        with open(f"{download_dir}/{filename}", "wb") as file:
-            for chunk_id, servers in zip(response["chunks"], response["locations"]):
-                self.retrieve_chunk_data(chunk_id, servers, file)
-                
         # Read the content of the file and display it to the user
-        with open(f"{download_dir}/{filename}", "r") as file:
-            content = file.read()
+        with open(local_path, "rb") as file:
+            content = file.read().decode("utf-8", errors="replace")
             print(f"Content of file {filename}: {content}")
 
     def retrieve_chunk_data(self, chunk_id, servers, file):
+        """
+        Write a chunk to file from the first replica that has it. Returns
+        (found, stale) where stale means some listed replica failed.
+        """
         content = None
+        stale = False
         for server in servers:
             try:
                 # Ensure 'server' is a tuple (host, port) before attempting connection
@@ -64,21 +207,22 @@ class Client:
                 print(f"Attempting to retrieve chunk {chunk_id} from server {server}")
 
                 # Create a socket to request chunk data from the server
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as chunk_socket:
+                with self.tracer.span(
+                    "fetch_chunk", chunk_id=chunk_id, server="%s:%s" % server
+                ), socket.socket(socket.AF_INET, socket.SOCK_STREAM) as chunk_socket:
                     chunk_socket.connect(server)  # Connect to the server
                     request = {"type": "READ", "chunk_id": chunk_id}
-                    chunk_socket.send(json.dumps(request).encode())
+                    send_message(chunk_socket, inject(request))
 
                     # Receive the response from the chunk server
-                    response = json.loads(chunk_socket.recv(1024))
+                    response = recv_message(chunk_socket)
                     if response.get("status") == "OK":
-                        content = response.get("content", "").rstrip("%")
-                        # print(
-                        #     f"Content of chunk {chunk_id} (without padding): {content}"
-                        # )
+                        content = response.get("content", b"")
                         break  # Exit the loop once data is successfully retrieved
+                    stale = True
 
-            except (ConnectionRefusedError, socket.timeout):
+            except (ConnectionError, socket.timeout):
+                stale = True
                 print(
                     f"Failed to connect to server {server} for chunk {chunk_id}. Trying next server..."
                 )
@@ -87,32 +231,40 @@ class Client:
             print(
                 f"Error: Unable to retrieve chunk {chunk_id} from any available server."
             )
-        else:
-            # Write the content to the file
-            file.write(
-                content.encode("utf-8")
-            )  # Ensure encoding when writing text data
+            return False, True
+
+        # Write the content to the file
+        file.write(content)
+        return True, stale
 
     # Write operation in Client
-    def write(self, filename, data):
+    @traced("write")
+    def write(self, filename, data, chunk_size=None):
+        """
+        Replace the contents of a file. chunk_size gives the file its own
+        chunk size, otherwise it keeps its current one.
+        """
         print("Writing data to file:", filename)
-        # 64 MB per chunk
-        chunks = [
-            data[i : i + self.chunk_size] for i in range(0, len(data), self.chunk_size)
-        ]
+        self.location_cache.invalidate(filename)
+        data = as_bytes(data)
 
-        request = {"type": "WRITE", "filename": filename, "data": data}
+        # Only the size goes to the master, the bytes go straight to chunk servers
+        request = {"type": "WRITE", "filename": filename, "length": len(data)}
+        if chunk_size is not None:
+            request["chunk_size"] = chunk_size
 
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect((self.master_host, self.master_port))
-            s.send(json.dumps(request).encode())
-            response = json.loads(s.recv(1024))
+            send_message(s, inject(request))
+            response = recv_message(s)
 
         if response.get("status") != "OK":
             print("Error:", response.get("message", "Unknown error"))
             return
 
         # Write each chunk to the primary server and replicate to secondary servers
+        size = response["chunk_size"]
+        chunks = [data[i : i + size] for i in range(0, len(data), size)]
         for idx, chunk_data in enumerate(chunks):
             chunk_id = response["chunk_ids"][idx]  # Get the chunk ID from the response
             primary_server = response["primary_servers"][
@@ -123,19 +275,22 @@ class Client:
             # Send chunk data to the primary chunk server
             self.send_chunk_data(tuple(primary_server), chunk_id, chunk_data, servers)
 
+    @traced("write_offset")
     def write_offset(self, filename, data, offset):
         print(f"Writing data at offset {offset} in file {filename}")
+        self.location_cache.invalidate(filename)
+        data = as_bytes(data)
         request = {
             "type": "WRITE_OFFSET",
             "filename": filename,
-            "data": data,
+            "length": len(data),
             "offset": offset,
         }
 
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect((self.master_host, self.master_port))
-            s.send(json.dumps(request).encode())
-            response = json.loads(s.recv(1024))
+            send_message(s, inject(request))
+            response = recv_message(s)
 
         if response.get("status") != "OK":
             print("Error:", response.get("message", "Unknown error"))
@@ -154,7 +309,7 @@ class Client:
 
             # Calculate data for this chunk
             write_data = data[
-                data_offset : data_offset + self.chunk_size - chunk_offset
+                data_offset : data_offset + response["chunk_size"] - chunk_offset
             ]
             data_offset += len(write_data)
             print(
@@ -176,10 +331,12 @@ class Client:
             "replicas": servers,
         }
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        with self.tracer.span(
+            "send_chunk", chunk_id=chunk_id, server="%s:%s" % primary_server
+        ), socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect(primary_server)
-            s.send(json.dumps(request).encode())
-            response = json.loads(s.recv(1024))
+            send_message(s, inject(request))
+            response = recv_message(s)
             print(f"Write response from primary server: {response}")
 
     def send_chunk_data_offset(self, server, chunk_id, data, chunk_offset, replicas):
@@ -193,10 +350,12 @@ class Client:
         }
 
         # Send the data to the primary server
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        with self.tracer.span(
+            "send_chunk", chunk_id=chunk_id, server="%s:%s" % server
+        ), socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect(server)
-            s.send(json.dumps(request).encode())
-            response = json.loads(s.recv(1024))
+            send_message(s, inject(request))
+            response = recv_message(s)
 
             if response.get("status") == "OK":
                 print(f"Data written successfully to chunk {chunk_id}")
@@ -205,12 +364,16 @@ class Client:
                     f"Failed to write data to chunk {chunk_id}: {response.get('message', 'Unknown error')}"
                 )
 
+    @traced("record_append")
     def record_append(self, filename, data):
+        # The last chunk gets a new id if it was shared with a snapshot
+        self.location_cache.invalidate(filename)
+        data = as_bytes(data)
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect((self.master_host, self.master_port))
-            request = {"type": "RECORD_APPEND", "filename": filename, "data": data}
-            s.send(json.dumps(request).encode())
-            response = json.loads(s.recv(1024))
+            request = {"type": "RECORD_APPEND", "filename": filename}
+            send_message(s, inject(request))
+            response = recv_message(s)
 
         if response["status"] != "OK":
             print("Error:", response.get("message"))
@@ -227,9 +390,10 @@ class Client:
                 "chunk_id": last_chunk_id,
                 "content": data,
                 "secondary_servers": secondary_servers,
+                "chunk_size": response["chunk_size"],
             }
-            s.send(json.dumps(append_request).encode())
-            append_response = json.loads(s.recv(1024))
+            send_message(s, inject(append_request))
+            append_response = recv_message(s)
 
             if append_response["status"] == "Insufficient Space":
                 print("Appending required a new chunk. Please retry.")
@@ -238,25 +402,30 @@ class Client:
             else:
                 print("Data appended successfully.")
 
+    @traced("retry_append")
     def retry_append(self, filename, data):
         print("Retrying append data to file:", filename)
-        # 64 MB per chunk
-        chunks = [
-            data[i : i + self.chunk_size] for i in range(0, len(data), self.chunk_size)
-        ]
+        self.location_cache.invalidate(filename)
+        data = as_bytes(data)
 
-        request = {"type": "RECORD_APPEND_RETRY", "filename": filename, "data": data}
+        request = {
+            "type": "RECORD_APPEND_RETRY",
+            "filename": filename,
+            "length": len(data),
+        }
 
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect((self.master_host, self.master_port))
-            s.send(json.dumps(request).encode())
-            response = json.loads(s.recv(1024))
+            send_message(s, inject(request))
+            response = recv_message(s)
 
         if response.get("status") != "OK":
             print("Error:", response.get("message", "Unknown error"))
             return
 
         # Write each chunk to the primary server and replicate to secondary servers
+        size = response["chunk_size"]
+        chunks = [data[i : i + size] for i in range(0, len(data), size)]
         for idx, chunk_data in enumerate(chunks):
             chunk_id = response["chunk_ids"][idx]  # Get the chunk ID from the response
             primary_server = response["primary_servers"][
@@ -267,10 +436,11 @@ class Client:
             # Send chunk data to the primary chunk server
             self.send_chunk_data(tuple(primary_server), chunk_id, chunk_data, servers)
 
+    @traced("upload")
     def upload(self, filename, filepath):
         print("Uploading file:", filepath)
 
-        with open(filepath, "r") as file:
+        with open(filepath, "rb") as file:
             data = file.read(self.chunk_size)
             is_first_chunk = True
 
@@ -285,8 +455,11 @@ class Client:
 
                 data = file.read(self.chunk_size)
 
+    @traced("rename")
     def rename(self, old_filename, new_filename):
         print(f"Renaming file from {old_filename} to {new_filename}")
+        self.location_cache.invalidate(old_filename)
+        self.location_cache.invalidate(new_filename)
         request = {
             "type": "RENAME",
             "old_filename": old_filename,
@@ -295,14 +468,62 @@ class Client:
 
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect((self.master_host, self.master_port))
-            s.send(json.dumps(request).encode())
-            response = json.loads(s.recv(1024))
+            send_message(s, inject(request))
+            response = recv_message(s)
+
+        if response.get("status") != "OK":
+            print("Error:", response.get("message", "Unknown error"))
+        else:
+            print(f"{response.get('message')}")
+
+    @traced("snapshot")
+    def snapshot(self, source, target):
+        """Copy a file on the master without moving any chunk data"""
+        self.location_cache.invalidate(target)
+        request = {"type": "SNAPSHOT", "source": source, "target": target}
+
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.connect((self.master_host, self.master_port))
+            send_message(s, inject(request))
+            response = recv_message(s)
 
         if response.get("status") != "OK":
             print("Error:", response.get("message", "Unknown error"))
         else:
             print(f"{response.get('message')}")
 
+    @traced("mkdir")
+    def mkdir(self, path):
+        request = {"type": "MKDIR", "path": path}
+
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.connect((self.master_host, self.master_port))
+            send_message(s, inject(request))
+            response = recv_message(s)
+
+        if response.get("status") != "OK":
+            print("Error:", response.get("message", "Unknown error"))
+        else:
+            print(f"{response.get('message')}")
+
+    @traced("ls")
+    def ls(self, path=""):
+        """List a directory, returns its entries or None on error"""
+        request = {"type": "LS", "path": path}
+
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.connect((self.master_host, self.master_port))
+            send_message(s, inject(request))
+            response = recv_message(s)
+
+        if response.get("status") != "OK":
+            print("Error:", response.get("message", "Unknown error"))
+            return None
+        for entry in response["entries"]:
+            suffix = "/" if entry["type"] == "directory" else ""
+            print(f"{entry['name']}{suffix}")
+        return response["entries"]
+
 
 # Example usage
 if __name__ == "__main__":
@@ -333,5 +554,12 @@ if __name__ == "__main__":
         data = input("Please enter the data that you want to write at the offset: ")
         offset = int(input("Please enter the offset : "))
         client.write_offset(filename, data, offset)
+    elif operation == "snapshot":
+        target = input("Enter the snapshot filename: ")
+        client.snapshot(filename, target)
+    elif operation == "mkdir":
+        client.mkdir(filename)
+    elif operation == "ls":
+        client.ls(filename)
     else:
         print("Invalid operation")
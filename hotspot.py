@@ -0,0 +1,62 @@
+import threading
+from time import time
+from collections import OrderedDict
+
+
+class HotChunkDetector:
+    """
+    Sliding-window access counter per chunk.
+
+    The window is split into a fixed number of time buckets, so recording an
+    access and reading the windowed count are O(buckets) and each tracked
+    chunk costs a fixed amount of memory. Only the max_chunks most recently
+    accessed chunks are tracked; colder ones are forgotten and count as idle.
+    """
+
+    def __init__(self, window=15, buckets=5, max_chunks=100000):
+        self.window = window
+        self.buckets = buckets
+        self.bucket_width = window / buckets
+        self.max_chunks = max_chunks
+        self.lock = threading.Lock()
+        # Chunk id -> [epoch of newest bucket, windowed total, bucket counts...]
+        self.counters = OrderedDict()
+
+    def advance(self, counter, epoch):
+        """Expire buckets that slid out of the window up to epoch."""
+        elapsed = epoch - counter[0]
+        if elapsed <= 0:
+            return
+        for step in range(1, min(elapsed, self.buckets) + 1):
+            slot = 2 + (counter[0] + step) % self.buckets
+            counter[1] -= counter[slot]
+            counter[slot] = 0
+        counter[0] = epoch
+
+    def record(self, chunk_id, now=None):
+        """Count one access and return the accesses within the window."""
+        epoch = int((time() if now is None else now) / self.bucket_width)
+        with self.lock:
+            counter = self.counters.get(chunk_id)
+            if counter is None:
+                counter = [epoch, 0] + [0] * self.buckets
+                self.counters[chunk_id] = counter
+                if len(self.counters) > self.max_chunks:
+                    self.counters.popitem(last=False)
+            else:
+                self.counters.move_to_end(chunk_id)
+                self.advance(counter, epoch)
+
+            counter[2 + epoch % self.buckets] += 1
+            counter[1] += 1
+            return counter[1]
+
+    def count(self, chunk_id, now=None):
+        """Accesses within the window without recording a new one."""
+        epoch = int((time() if now is None else now) / self.bucket_width)
+        with self.lock:
+            counter = self.counters.get(chunk_id)
+            if counter is None:
+                return 0
+            self.advance(counter, epoch)
+            return counter[1]
@@ -0,0 +1,106 @@
+import threading
+from time import time
+from collections import OrderedDict
+
+
+class LocationCache:
+    """
+    Client-side cache of chunk handles and replica locations.
+
+    Entries are keyed by (filename, chunk index), plus a (filename, None)
+    entry holding the number of chunks in the file. Every entry expires after
+    ttl seconds and the least recently used entries are evicted once the
+    cache holds max_entries.
+    """
+
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expiry, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def lookup(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expiry, value = entry
+        if expiry < now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def store(self, key, value, now):
+        self.entries[key] = (now + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_file(self, filename):
+        """
+        Return (chunk_ids, locations) for a file if every chunk is cached,
+        otherwise None.
+        """
+        now = time()
+        with self.lock:
+            num_chunks = self.lookup((filename, None), now)
+            if num_chunks is not None:
+                chunk_ids = []
+                locations = []
+                for index in range(num_chunks):
+                    entry = self.lookup((filename, index), now)
+                    if entry is None:
+                        break
+                    chunk_ids.append(entry[0])
+                    locations.append(entry[1])
+                else:
+                    self.hits += 1
+                    return chunk_ids, locations
+            self.misses += 1
+            return None
+
+    def put_file(self, filename, chunk_ids, locations):
+        now = time()
+        with self.lock:
+            self.store((filename, None), len(chunk_ids), now)
+            for index, (chunk_id, servers) in enumerate(zip(chunk_ids, locations)):
+                self.store((filename, index), (chunk_id, servers), now)
+
+    def put_chunks(self, filename, start, num_chunks, chunk_ids, locations):
+        """
+        Cache a range of chunks starting at chunk index start, along with the
+        total number of chunks in the file.
+        """
+        now = time()
+        with self.lock:
+            self.store((filename, None), num_chunks, now)
+            for offset, (chunk_id, servers) in enumerate(zip(chunk_ids, locations)):
+                self.store((filename, start + offset), (chunk_id, servers), now)
+
+    def invalidate(self, filename, index=None):
+        """
+        Drop a single chunk entry, or every entry of the file if index is None.
+        """
+        with self.lock:
+            if index is not None:
+                keys = [(filename, index)]
+            else:
+                keys = [key for key in self.entries if key[0] == filename]
+            for key in keys:
+                if self.entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self.entries),
+            }
@@ -2,13 +2,49 @@ import os
 import socket
 import threading
 import json
-import random
-from time import time
+from time import time, sleep, perf_counter
 import queue
+import heapq
+import asyncio
+import argparse
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from chunktable import ChunkTable
+from checkpoint import BinaryCheckpoint
+from hotspot import HotChunkDetector
+from oplog import OperationLog
+from placement import make_placement, PLACEMENT_POLICIES
+from replication import ReplicationScheduler
+from namespace import Namespace
+from metrics import Metrics
+from tracing import Tracer, inject
+from protocol import (
+    send_message,
+    recv_message,
+    recv_sized_message,
+    read_sized_message,
+    write_message,
+    call,
+)
+
+
+MAX_CHUNK_SIZE = 64 * 1024 * 1024  # Chunks travel whole in one protocol message
 
 
 class MasterServer:
-    def __init__(self, host, port, root_dir="master_metadata", chunk_size=12):
+    def __init__(
+        self,
+        host,
+        port,
+        root_dir="master_metadata",
+        chunk_size=12,
+        replication_factor=3,
+        placement="load_aware",
+        metrics_port=None,
+        trace_dir=None,
+    ):
         self.host = host
         self.port = port
         self.root_dir = root_dir
@@ -16,14 +52,38 @@ class MasterServer:
             20  # Requests server can handle within threshold_timeout
         )
         self.threshold_timeout = 15  # seconds
-        self.replication_factor = 3
+        self.replication_factor = replication_factor  # Handed to chunk servers and clients
         self.chunk_servers = []  # List of chunk server addresses
         self.next_chunk_id = 0
         self.lock = threading.Lock()
-        self.chunk_size = chunk_size
-        self.chunk_access_times = {}  # Track chunk access times
+        self.chunk_size = chunk_size  # Default, files may override it
+        self.placement = make_placement(placement)  # Chooses servers for new chunks
+        self.hot_chunks = HotChunkDetector(window=self.threshold_timeout)
         self.chunk_modified_replication = {}  # Track chunks modified for replication
 
+        # Replica cool-down: drop dynamic replicas of chunks that went cold
+        self.cooldown_interval = self.threshold_timeout  # seconds between checks
+        self.cooldown_threshold = self.max_request_threshold // 4  # accesses per window
+        self.cooldown_checks = 2  # consecutive cold checks before shrinking
+        self.cold_checks = {}  # Chunk id -> consecutive cold checks so far
+        self.cooldown_stats = {"replicas_removed": 0, "bytes_reclaimed": 0}
+
+        # Garbage collection: deleted chunks are only dropped from metadata and
+        # chunk servers remove them after reporting their inventory
+        self.gc_stats = {"reports": 0, "collected": 0}
+
+        # Chunk locations are not persisted. Chunk servers report their chunks in
+        # full when they register and as deltas on every heartbeat.
+        self.inventory_versions = {}  # Chunk server id -> last applied inventory version
+        self.inventory_bytes = {}  # Chunk server id -> bytes of chunks in its last full report
+        self.pending_reports = set()  # Chunk servers asked for a full report
+        # Reports, deltas and replication update locations from several threads
+        self.locations_lock = threading.RLock()
+        # A report taken before a granted write lands does not list the chunk
+        # yet, its locations are kept until the grace period ends
+        self.mutation_grants = {}  # Chunk id -> time its locations were handed out
+        self.mutation_grace = 60  # seconds
+
         # Heartbeat
         self.heartbeat_data = {}
         self.heartbeat_queue = queue.Queue()
@@ -31,68 +91,496 @@ class MasterServer:
         self.heartbeat_failure_threshold = 3 * self.heartbeat_interval  # seconds
         self.max_chunk_server_request_threshold = 20
         self.heartbeat_lock = threading.Lock()
+        self.heartbeat_condition = threading.Condition(self.heartbeat_lock)
+        self.heartbeat_deadlines = []  # Heap of (expiry time, chunk server id)
         self.failed_chunk_servers = set()
 
+        # Re-replication runs in the background, most under-replicated chunks first
+        self.replication_scheduler = ReplicationScheduler(
+            self.plan_replication, self.copy_chunk
+        )
+
+        # Request latencies and sizes, served over HTTP if metrics_port is set
+        self.metrics = Metrics("master")
+        self.metrics_port = metrics_port
+        self.tracer = Tracer("master", trace_dir)  # Spans of traced client requests
+
         # Load metadata from persistent storage if available
         os.makedirs(self.root_dir, exist_ok=True)
-        self.file_to_chunks = self.load_metadata("file_to_chunks.json")
-        self.chunk_locations = self.load_metadata("chunk_locations.json")
+        self.file_to_chunks = {}
+        self.file_chunk_sizes = {}  # Files whose chunk size differs from the default
+        self.logged_chunk_size = None  # Default chunk size the metadata was written with
+        self.namespace = Namespace()  # Directory tree and per-path locks
+        self.chunk_locations = ChunkTable()  # Also indexes chunks by server
+        self.oplog = OperationLog(
+            self.root_dir, codec=BinaryCheckpoint(), metrics=self.metrics
+        )
+        self.load_metadata()
+
+        # Shadow masters tail recently committed mutations from memory
+        self.stream_epoch = f"{os.getpid()}-{time()}"  # Changes when the master restarts
+        self.stream = deque(maxlen=10000)  # (stream sequence, record) of recent mutations
+        self.stream_condition = threading.Condition()
+        self.stream_seq = 0
+        self.committed_seq = 0
+        self.adopt_chunk_size()
+
+    def load_metadata(self):
+        """
+        Restore metadata from the latest checkpoint and replay the operation log.
+        """
+        if self.oplog.recover(self.restore_metadata, self.apply_mutation):
+            print(
+                f"Recovered {len(self.file_to_chunks)} files and {len(self.chunk_locations)} chunks"
+            )
+            return
+
+        # Fall back to the JSON files written by older versions of the master
+        legacy_state = {}
+        for key in ("file_to_chunks", "chunk_locations"):
+            filepath = os.path.join(self.root_dir, f"{key}.json")
+            if os.path.exists(filepath):
+                with open(filepath, "r") as f:
+                    legacy_state[key] = json.load(f)
+        if legacy_state:
+            self.restore_metadata(legacy_state)
+            # Recovery ignores the JSON files once a log exists, so the state
+            # has to be in a checkpoint before any record is logged
+            if not self.oplog.checkpoint(self.snapshot_metadata):
+                raise RuntimeError("Unable to checkpoint metadata restored from JSON files")
+            print(f"Restored {len(self.file_to_chunks)} files from JSON metadata")
+
+    def restore_metadata(self, state):
+        """
+        Replace in-memory metadata with a checkpointed state.
+        """
+        self.file_to_chunks = state.get("file_to_chunks", {})
+        self.file_chunk_sizes = state.get("file_chunk_sizes", {})
+        self.logged_chunk_size = state.get("chunk_size")
+        self.namespace = Namespace()
+        for path in state.get("directories", []):
+            self.namespace.mkdir(path)
+        for filename in self.file_to_chunks:
+            self.namespace.add_file(filename)
+        self.next_chunk_id = state.get("next_chunk_id")
+
+        locations = state.get("chunk_locations", {})
+        if isinstance(locations, ChunkTable):
+            # Binary checkpoints load the table whole, reference counts included
+            self.chunk_locations = locations
+        else:
+            # JSON turns integer chunk ids into string keys, the table converts them back
+            self.chunk_locations = ChunkTable()
+            for chunk_id, servers in locations.items():
+                self.chunk_locations[chunk_id] = servers
+
+            # Reference counts of chunks shared by snapshots follow from the files
+            references = {}
+            for chunk_ids in self.file_to_chunks.values():
+                for chunk_id in chunk_ids:
+                    references[chunk_id] = references.get(chunk_id, 0) + 1
+            for chunk_id, count in references.items():
+                if count > 1 and chunk_id in self.chunk_locations:
+                    self.chunk_locations.shared[chunk_id] = count
+
+        if self.next_chunk_id is None:
+            self.next_chunk_id = max(self.chunk_locations, default=-1) + 1
+
+    def snapshot_metadata(self, locations=False):
+        """
+        Return a copy of the full metadata state for a checkpoint. Chunk
+        locations are left out unless asked for.
+        """
+        return {
+            "file_to_chunks": {
+                filename: list(chunk_ids)
+                for filename, chunk_ids in self.file_to_chunks.items()
+            },
+            "file_chunk_sizes": dict(self.file_chunk_sizes),
+            "chunk_size": self.logged_chunk_size,
+            "directories": self.namespace.directories(),
+            "chunk_locations": self.chunk_locations.copy(locations),
+            "next_chunk_id": self.next_chunk_id,
+        }
+
+    def apply_mutation(self, record):
+        """
+        Apply a single operation log record to the in-memory metadata.
+        """
+        op = record["op"]
+        if op == "SET_FILE":
+            self.file_to_chunks[record["filename"]] = list(record["chunk_ids"])
+            if "chunk_size" in record:
+                # Chunks laid out at a new size, None is the default
+                if record["chunk_size"] is None:
+                    self.file_chunk_sizes.pop(record["filename"], None)
+                else:
+                    self.file_chunk_sizes[record["filename"]] = record["chunk_size"]
+            self.namespace.add_file(record["filename"])
+        elif op == "APPEND_CHUNK":
+            self.file_to_chunks.setdefault(record["filename"], []).append(
+                record["chunk_id"]
+            )
+            self.namespace.add_file(record["filename"])
+        elif op == "DELETE_FILE":
+            self.file_to_chunks.pop(record["filename"], None)
+            self.file_chunk_sizes.pop(record["filename"], None)
+            self.namespace.remove_file(record["filename"])
+        elif op == "RENAME_FILE":
+            self.file_to_chunks[record["new_filename"]] = self.file_to_chunks.pop(
+                record["old_filename"]
+            )
+            if record["old_filename"] in self.file_chunk_sizes:
+                self.file_chunk_sizes[record["new_filename"]] = (
+                    self.file_chunk_sizes.pop(record["old_filename"])
+                )
+            self.namespace.remove_file(record["old_filename"])
+            self.namespace.add_file(record["new_filename"])
+        elif op == "MKDIR":
+            self.namespace.mkdir(record["path"])
+        elif op == "SET_CHUNK_SIZE":
+            if record["chunk_size"] is None:
+                self.file_chunk_sizes.pop(record["filename"], None)
+            else:
+                self.file_chunk_sizes[record["filename"]] = record["chunk_size"]
+        elif op == "SET_DEFAULT_CHUNK_SIZE":
+            self.logged_chunk_size = record["chunk_size"]
+        elif op == "SNAPSHOT_FILE":
+            chunk_ids = list(self.file_to_chunks[record["source"]])
+            self.file_to_chunks[record["target"]] = chunk_ids
+            if record["source"] in self.file_chunk_sizes:
+                self.file_chunk_sizes[record["target"]] = self.file_chunk_sizes[
+                    record["source"]
+                ]
+            self.namespace.add_file(record["target"])
+            for chunk_id in chunk_ids:
+                self.chunk_locations.add_ref(chunk_id)
+        elif op in ("CREATE_CHUNK", "SET_CHUNK"):
+            # Older logs hold SET_CHUNK with locations, which are no longer trusted
+            chunk_id = record["chunk_id"]
+            if chunk_id not in self.chunk_locations:
+                self.chunk_locations[chunk_id] = []
+            self.next_chunk_id = max(self.next_chunk_id, chunk_id + 1)
+        elif op == "SET_LOCATIONS":
+            if record["chunk_id"] in self.chunk_locations:
+                self.chunk_locations[record["chunk_id"]] = record["servers"]
+        elif op == "DELETE_CHUNK":
+            # Drops one file's reference, the chunk goes once no snapshot shares it
+            if not self.chunk_locations.drop_ref(record["chunk_id"]):
+                self.chunk_locations.pop(record["chunk_id"], None)
+        else:
+            print(f"Unknown operation log record: {record}")
+
+    def mutate(self, record, log=True):
+        """
+        Apply a metadata mutation, append it to the operation log and publish
+        it to shadow masters. Unlogged mutations, like chunk locations, are
+        only published.
+        """
+        with self.oplog.lock:
+            self.apply_mutation(record)
+            if log:
+                self.oplog.append(record)
+            self.stream_seq += 1
+            self.stream.append((self.stream_seq, record))
+
+    def create_chunk(self, chunk_id, servers):
+        self.mutate({"op": "CREATE_CHUNK", "chunk_id": chunk_id})
+        self.set_locations(chunk_id, servers)
+
+    def set_locations(self, chunk_id, servers):
+        """
+        Record the servers holding a chunk. Locations are rebuilt from chunk
+        server reports after a restart and never logged.
+        """
+        self.mutate(
+            {"op": "SET_LOCATIONS", "chunk_id": chunk_id, "servers": servers}, log=False
+        )
 
-    def load_metadata(self, filename):
-        filepath = os.path.join(self.root_dir, filename)
-        if os.path.exists(filepath):
-            with open(filepath, "r") as f:
-                return json.load(f)
-        return {}
+    def allocate_chunk_id(self):
+        """
+        Reserve the next chunk id. Shares the log lock with apply_mutation,
+        which also advances next_chunk_id.
+        """
+        with self.oplog.lock:
+            chunk_id = self.next_chunk_id
+            self.next_chunk_id += 1
+            return chunk_id
 
-    def save_metadata(self, data, filename):
-        filepath = os.path.join(self.root_dir, filename)
-        with open(filepath, "w") as f:
-            json.dump(data, f, indent=4)
+    def commit_metadata(self):
+        """
+        Make logged mutations durable and checkpoint when the log grows large.
+        """
+        target = self.stream_seq
+        with self.tracer.span("oplog_commit"):
+            self.oplog.commit()
+        if target > self.committed_seq:
+            with self.stream_condition:
+                self.committed_seq = max(self.committed_seq, target)
+                self.stream_condition.notify_all()
+        self.oplog.maybe_checkpoint(self.snapshot_metadata)
 
     def start(self):
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server_socket.bind((self.host, self.port))
         server_socket.listen(5)
         print(f"Master server started on {self.host}:{self.port}")
 
-        # Heartbeats
-        threading.Thread(target=self.receive_heartbeats).start()
-        threading.Thread(target=self.process_heartbeats).start()
-        threading.Thread(target=self.check_failed_servers).start()
+        self.start_background_threads()
 
         while True:
             client_socket, address = server_socket.accept()
             threading.Thread(target=self.handle_client, args=(client_socket,)).start()
 
+    def start_background_threads(self):
+        if self.metrics_port is not None:
+            self.metrics.serve(self.host, self.metrics_port)
+        self.replication_scheduler.start()
+        threading.Thread(target=self.receive_heartbeats).start()
+        threading.Thread(target=self.process_heartbeats).start()
+        threading.Thread(target=self.check_failed_servers).start()
+        threading.Thread(target=self.cool_down_replicas, daemon=True).start()
+
+    def start_async(self, workers=32):
+        """
+        Serve clients from an asyncio event loop instead of a thread per
+        connection. Connections stay open for any number of requests.
+        Lookups answered from memory run on the loop, requests that log
+        mutations, call chunk servers or wait on a lock run on a bounded
+        thread pool.
+        """
+        self.start_background_threads()
+        asyncio.run(self.serve_async(workers))
+
+    async def serve_async(self, workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        server = await asyncio.start_server(
+            self.handle_client_async, self.host, self.port
+        )
+        print(f"Master server started on {self.host}:{self.port} (asyncio)")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client_async(self, reader, writer):
+        """
+        Handle back-to-back framed requests on one persistent connection.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                data, received = await read_sized_message(reader)
+                if data is None:
+                    break
+                start = perf_counter()
+                response = self.lookup_request(data)
+                if response is None:
+                    response = await loop.run_in_executor(
+                        self.executor, self.traced_request, data
+                    )
+                sent = await write_message(writer, response)
+                self.metrics.observe_request(
+                    data.get("type"),
+                    perf_counter() - start,
+                    received,
+                    sent,
+                )
+        except ConnectionError as e:
+            print(f"Client connection lost: {e}")
+        finally:
+            writer.close()
+
     def handle_client(self, client_socket):
-        data = json.loads(client_socket.recv(1024))
+        """
+        Serve framed requests on a connection until the client closes it.
+        """
+        try:
+            while True:
+                data, received = recv_sized_message(client_socket)
+                if data is None:
+                    break
+                start = perf_counter()
+                response = self.traced_request(data)
+
+                # print(f"DEBUG: Sending response {response} for {response} to client {client_socket}")
+                sent = send_message(client_socket, response)
+                self.metrics.observe_request(
+                    data.get("type"),
+                    perf_counter() - start,
+                    received,
+                    sent,
+                )
+        except ConnectionError as e:
+            print(f"Client connection lost: {e}")
+        finally:
+            client_socket.close()
+
+    def traced_request(self, data):
+        with self.tracer.span(data.get("type"), data.get("trace")):
+            return self.process_request(data)
+
+    def process_request(self, data):
+        """
+        Dispatch a decoded client request and return its response.
+        """
         request = data.get("type")
         response = {}
 
         if request == "REGISTER_CHUNKSERVER":
-            self.handle_register_chunkserver(data["address"])
-            response = {"status": "OK", "message": "Chunk server registered"}
+            garbage = self.handle_register_chunkserver(
+                data["address"], data.get("inventory")
+            )
+            response = {
+                "status": "OK",
+                "message": "Chunk server registered",
+                "garbage": garbage,
+                **self.cluster_config(),
+            }
+        elif request == "CONFIG":
+            response = {"status": "OK", **self.cluster_config()}
         elif request == "READ":
-            response = self.handle_read(data["filename"])
+            filename = self.namespace.normalize(data["filename"])
+            with self.namespace.locked(read=[filename]):
+                response = self.handle_read(filename)
         elif request == "WRITE":
-            response = self.handle_write(data["filename"], data.get("data"))
+            filename = self.namespace.normalize(data["filename"])
+            with self.namespace.locked(write=[filename]):
+                response = self.handle_write(
+                    filename, data.get("length", 0), data.get("chunk_size")
+                )
         elif request == "RECORD_APPEND":
-            response = self.handle_record_append(data["filename"], data.get("data"))
+            filename = self.namespace.normalize(data["filename"])
+            # Write lock, the last chunk may be copied away from a snapshot
+            with self.namespace.locked(write=[filename]):
+                response = self.handle_record_append(filename)
         elif request == "RECORD_APPEND_RETRY":
-            response = self.retrying_append(data["filename"], data.get("data"))
+            filename = self.namespace.normalize(data["filename"])
+            with self.namespace.locked(write=[filename]):
+                response = self.retrying_append(filename, data.get("length", 0))
         elif request == "DELETE":
-            response = self.handle_delete(data["filename"])
+            filename = self.namespace.normalize(data["filename"])
+            with self.namespace.locked(write=[filename]):
+                response = self.handle_delete(filename)
+        elif request == "SNAPSHOT":
+            source = self.namespace.normalize(data["source"])
+            target = self.namespace.normalize(data["target"])
+            with self.namespace.locked(read=[source], write=[target]):
+                response = self.handle_snapshot(source, target)
+        elif request == "MKDIR":
+            path = self.namespace.normalize(data["path"])
+            with self.namespace.locked(write=[path]):
+                response = self.handle_mkdir(path)
+        elif request == "LS":
+            path = self.namespace.normalize(data.get("path", ""))
+            with self.namespace.locked(read=[path]):
+                response = self.handle_ls(path)
+        elif request == "CHUNK_REPORT":
+            response = self.handle_chunk_report(
+                data["chunk_server_id"], data["inventory"]
+            )
+        elif request == "LOG_TAIL":
+            response = self.handle_log_tail(
+                data.get("epoch"), data.get("after", 0), data.get("wait", 0)
+            )
+        elif request == "BATCH_LOOKUP":
+            response = self.handle_batch_lookup(data.get("files", []))
+        elif request == "REPLICATION_STATUS":
+            response = self.replication_status()
         elif request == "RENAME":
-            response = self.handle_rename(data["old_filename"], data["new_filename"])
+            old_filename = self.namespace.normalize(data["old_filename"])
+            new_filename = self.namespace.normalize(data["new_filename"])
+            with self.namespace.locked(write=[old_filename, new_filename]):
+                response = self.handle_rename(old_filename, new_filename)
         elif request == "WRITE_OFFSET":
-            response = self.handle_write_offset(
-                data["filename"], data["data"], data["offset"]
-            )
+            filename = self.namespace.normalize(data["filename"])
+            with self.namespace.locked(write=[filename]):
+                response = self.handle_write_offset(
+                    filename, data.get("length", 0), data["offset"]
+                )
+
+        # Mutations must be durable before the client sees the response
+        self.commit_metadata()
+        return response
+
+    def lookup_request(self, data):
+        """
+        Answer a request served from memory without waiting on a lock, for
+        the event loop. Returns None if the request is not such a lookup or
+        its namespace lock is taken, the caller then runs process_request.
+        """
+        request = data.get("type")
+        if request == "CONFIG":
+            with self.tracer.span(request, data.get("trace")):
+                return {"status": "OK", **self.cluster_config()}
+        if request == "REPLICATION_STATUS":
+            with self.tracer.span(request, data.get("trace")):
+                return self.replication_status()
+        if request == "READ":
+            path, handler = data["filename"], self.handle_read
+        elif request == "LS":
+            path, handler = data.get("path", ""), self.handle_ls
+        else:
+            return None
+
+        path = self.namespace.normalize(path)
+        with self.namespace.locked(read=[path], blocking=False) as acquired:
+            if not acquired:
+                return None
+            with self.tracer.span(request, data.get("trace")):
+                return handler(path)
 
-        # print(f"DEBUG: Sending response {response} for {response} to client {client_socket}")
-        client_socket.send(json.dumps(response).encode())
-        client_socket.close()
+    def replication_status(self):
+        return {
+            "status": "OK",
+            "replication": self.replication_scheduler.stats(),
+            "cooldown": dict(self.cooldown_stats),
+            "gc": dict(self.gc_stats),
+            "inventory": {
+                server_id: {
+                    "version": version,
+                    "bytes": self.inventory_bytes.get(server_id, 0),
+                }
+                for server_id, version in self.inventory_versions.items()
+            },
+        }
+
+    def handle_log_tail(self, epoch, after, wait, limit=1000):
+        """
+        Return committed mutations after log sequence after, waiting up to
+        wait seconds for new ones. A follower from an earlier master run, or
+        one that fell behind the in-memory stream, gets the full state instead.
+        """
+        with self.stream_condition:
+            if epoch == self.stream_epoch:
+                self.stream_condition.wait_for(
+                    lambda: self.committed_seq > after, timeout=min(wait, 5)
+                )
+            committed = self.committed_seq
+
+        with self.oplog.lock:
+            first = self.stream[0][0] if self.stream else committed + 1
+            if epoch != self.stream_epoch or after + 1 < first:
+                state = self.snapshot_metadata(locations=True)
+                state["chunk_locations"] = state["chunk_locations"].to_dict()
+                return {
+                    "status": "OK",
+                    "epoch": self.stream_epoch,
+                    "seq": self.stream_seq,
+                    "state": state,
+                    "records": [],
+                }
+
+            start = after + 1 - first
+            count = max(0, min(committed - after, limit))
+            records = [
+                record for _, record in itertools.islice(self.stream, start, start + count)
+            ]
+        return {
+            "status": "OK",
+            "epoch": self.stream_epoch,
+            "seq": after + len(records),
+            "records": records,
+        }
 
     def receive_heartbeats(self):
         """
@@ -105,7 +593,7 @@ class MasterServer:
 
         while True:
             try:
-                data = heartbeat_socket.recvfrom(1024)
+                data = heartbeat_socket.recvfrom(65535)
                 heartbeat_data = json.loads(data[0].decode())
 
                 # Check if heartbeat
@@ -116,9 +604,21 @@ class MasterServer:
                 chunk_server_id = heartbeat_data["chunk_server_id"]
                 timestamp = heartbeat_data["timestamp"]
                 num_requests = heartbeat_data["num_requests"]
+                disk_usage = {
+                    "free_bytes": heartbeat_data.get("free_bytes"),
+                    "capacity_bytes": heartbeat_data.get("capacity_bytes"),
+                }
 
                 # print(f"Received heartbeat from chunk server {chunk_server_id}, {timestamp}, {num_requests}")
-                self.heartbeat_queue.put((chunk_server_id, timestamp, num_requests))
+                self.heartbeat_queue.put(
+                    (
+                        chunk_server_id,
+                        timestamp,
+                        num_requests,
+                        disk_usage,
+                        heartbeat_data.get("inventory"),
+                    )
+                )
 
             except Exception as e:
                 print(f"Error receiving heartbeat: {e}")
@@ -129,17 +629,22 @@ class MasterServer:
         """
         while True:
             try:
-                if self.heartbeat_queue.empty():
-                    continue
-
-                chunk_server_id, timestamp, num_requests = self.heartbeat_queue.get()
+                # Block until a heartbeat arrives
+                chunk_server_id, timestamp, num_requests, disk_usage, inventory = (
+                    self.heartbeat_queue.get()
+                )
 
                 # print(f"Processing heartbeat from chunk server {chunk_server_id}")
 
                 # Check if the chunk server is already in the failed list and remove it since it is now active
-                if chunk_server_id in self.failed_chunk_servers:
-                    print(f"Chunk server {chunk_server_id} is now active")
-                    self.failed_chunk_servers.remove(chunk_server_id)
+                with self.heartbeat_lock:
+                    if chunk_server_id in self.failed_chunk_servers:
+                        print(f"Chunk server {chunk_server_id} is now active")
+                        self.failed_chunk_servers.remove(chunk_server_id)
+
+                # Keep the chunk locations of the server up to date
+                if inventory is not None:
+                    self.apply_inventory_delta(chunk_server_id, inventory)
 
                 # Check if requests are beyond the threshold
                 if num_requests > self.max_chunk_server_request_threshold:
@@ -149,35 +654,58 @@ class MasterServer:
                     print("Replicating chunks...")
                     self.handle_server_replication(chunk_server_id, False)
 
-                # Save the heartbeat data
-                with self.heartbeat_lock:
+                # Save the heartbeat data and push back the server's failure deadline
+                deadline = time() + self.heartbeat_failure_threshold
+                with self.heartbeat_condition:
                     self.heartbeat_data[chunk_server_id] = {
                         "timestamp": timestamp,
                         "num_requests": num_requests,
+                        "deadline": deadline,
+                        **disk_usage,
                     }
+                    heapq.heappush(self.heartbeat_deadlines, (deadline, chunk_server_id))
+                    # Only wake the failure detector if this is now the earliest deadline
+                    if self.heartbeat_deadlines[0][1] == chunk_server_id:
+                        self.heartbeat_condition.notify()
 
             except Exception as e:
                 print(f"Error processing heartbeat: {e}")
 
     def check_failed_servers(self):
         """
-        Iterate over the heartbeat data to check for failed servers.
+        Sleep until the earliest heartbeat deadline and mark servers whose
+        deadline passed without a newer heartbeat as failed.
         """
         while True:
             try:
-                with self.heartbeat_lock:
-                    for chunk_server_id, data in self.heartbeat_data.items():
+                failed_server = None
+                with self.heartbeat_condition:
+                    while failed_server is None:
+                        if not self.heartbeat_deadlines:
+                            self.heartbeat_condition.wait()
+                            continue
+
+                        deadline, chunk_server_id = self.heartbeat_deadlines[0]
                         current_time = time()
-                        last_heartbeat = data["timestamp"]
+                        if deadline > current_time:
+                            self.heartbeat_condition.wait(deadline - current_time)
+                            continue
+
+                        heapq.heappop(self.heartbeat_deadlines)
+                        data = self.heartbeat_data.get(chunk_server_id)
                         if (
-                            current_time - last_heartbeat
-                            > self.heartbeat_failure_threshold and
-                            chunk_server_id not in self.failed_chunk_servers
+                            data is None
+                            or data["deadline"] != deadline
+                            or chunk_server_id in self.failed_chunk_servers
                         ):
-                            print(f"Chunk server {chunk_server_id} failed")
-                            self.failed_chunk_servers.add(chunk_server_id)
-                            print("Replicating chunks...")
-                            self.handle_server_replication(chunk_server_id, True)
+                            continue  # Superseded by a later heartbeat
+
+                        self.failed_chunk_servers.add(chunk_server_id)
+                        failed_server = chunk_server_id
+
+                print(f"Chunk server {failed_server} failed")
+                print("Replicating chunks...")
+                self.handle_server_replication(failed_server, True)
 
             except Exception as e:
                 print(f"Error checking failed servers: {e}")
@@ -189,127 +717,167 @@ class MasterServer:
         host, port = server.split(":")
         return [host, int(port)]
 
+    def get_server_id(self, server):
+        """
+        Function to convert a [host, port] server address to its id string
+        """
+        return f"{server[0]}:{server[1]}"
+
     def handle_server_replication(self, server_details, failed):
         """
-        Replicate chunks from a server to other servers.
+        Queue re-replication of the chunks held by a failed or overloaded server.
+        The copies run on the replication scheduler, not on the calling thread.
         """
 
         server_list = self.get_server_list(server_details)
+        if failed:
+            # Its chunks are relocated, it must send a full report if it returns
+            self.inventory_versions.pop(server_details, None)
+
+        # Snapshot of the hosted chunks, replication below updates the index
+        hosted_chunks = self.chunk_locations.chunks_on(server_details)
+
+        for chunk_id in hosted_chunks:
+            if failed:
+                # Remove the failed server and restore the replication factor
+                with self.locations_lock:
+                    servers = self.chunk_locations.get(chunk_id)
+                    if servers is None:
+                        continue
+                    servers = [
+                        server
+                        for server in servers
+                        if self.get_server_id(server) != server_details
+                    ]
+                    self.set_locations(chunk_id, servers)
+                desired = max(self.replication_factor, len(servers) + 1)
+            else:
+                servers = self.chunk_locations.get(chunk_id)
+                if servers is None:
+                    continue
+                # Spread load with one more replica away from the busy server
+                desired = len(servers) + 1
 
-        found = False
-
-        for chunk_id, servers in self.chunk_locations.items():
-            if server_list in servers:
-
-                found = True
-
-                print(f"DEBUG: Replicating chunk {chunk_id} from server {server_list}")
-
-                req = self.handle_increase_replication(chunk_id)
-
-                if failed:
-                    # Remove the failed server from the chunk locations
-                    servers.remove(server_list)
-                    self.chunk_locations[chunk_id] = servers
-                    self.save_metadata(self.chunk_locations, "chunk_locations.json")
+            live, _ = self.plan_replication(chunk_id)
+            self.replication_scheduler.schedule(chunk_id, desired, len(live))
 
-                if not req:
-                    print(
-                        f"Failed to replicate chunk {chunk_id} from server {server_list}"
-                    )
-                else:
-                    print(
-                        f"Successfully replicated chunk {chunk_id} from server {server_list}"
-                    )
+        self.commit_metadata()
 
-        if not found:
+        if not hosted_chunks:
             print(f"No chunks found for server {server_list}")
         else:
-            print(f"Replication complete for server {server_list}")
+            print(
+                f"Queued {len(hosted_chunks)} chunks for replication from server {server_list}"
+            )
 
-    def handle_increase_replication(self, chunk_id):
+    def choose_chunk_servers(self):
         """
-        Increase the replication factor for a chunk by adding a new replica server.
+        Pick a primary and secondary servers for a new chunk using the
+        placement policy and the latest heartbeat figures of live servers.
+        Returns None if fewer servers are live than the replication factor.
         """
-        if chunk_id not in self.chunk_locations:
-            print(f"Chunk {chunk_id} not found")
-            return False
+        candidates = []
+        with self.heartbeat_lock:
+            for server in self.chunk_servers:
+                server_id = self.get_server_id(server)
+                if server_id in self.failed_chunk_servers:
+                    continue
+                stats = self.heartbeat_data.get(server_id, {})
+                candidates.append(
+                    {
+                        "server": server,
+                        "free_bytes": stats.get("free_bytes"),
+                        "capacity_bytes": stats.get("capacity_bytes"),
+                        "num_requests": stats.get("num_requests", 0),
+                        "in_flight": self.replication_scheduler.pending(server_id),
+                    }
+                )
 
-        # Retrieve the current chunk locations
-        current_locations = self.chunk_locations[chunk_id]
-        # print(f"DEBUG: Current locations for chunk {chunk_id}: {current_locations}")
+        chosen = self.placement.choose(candidates, self.replication_factor)
+        if len(chosen) < self.replication_factor:
+            return None
+        return chosen[0], chosen[1:]
 
-        # Randomly select a new replica server from the available chunk servers but not in chunk locations
-        # available_servers = set(self.chunk_servers) - set(current_locations)
-        available_servers = []
-        for server in self.chunk_servers:
-            if server not in current_locations:
-                available_servers.append(server)
+    def place_chunks(self, count):
+        """
+        Choose the servers of count new chunks before any metadata changes.
+        Returns a list of (primary, secondaries), or None if a chunk cannot
+        get all its replicas.
+        """
+        placements = []
+        for _ in range(count):
+            placement = self.choose_chunk_servers()
+            if placement is None:
+                return None
+            placements.append(placement)
+        return placements
+
+    def plan_replication(self, chunk_id):
+        """
+        Return the live replicas of a chunk and the servers that could take a new copy.
+        """
+        servers = self.chunk_locations.get(chunk_id, [])
+        live = [
+            server
+            for server in servers
+            if self.get_server_id(server) not in self.failed_chunk_servers
+        ]
+        targets = [
+            server
+            for server in self.chunk_servers
+            if server not in servers
+            and self.get_server_id(server) not in self.failed_chunk_servers
+        ]
+        return live, targets
 
-        if not available_servers:
-            print("INC_REPL: No available servers to increase replication")
+    def copy_chunk(self, chunk_id, source, target):
+        """
+        Copy one replica of a chunk from source to target for the scheduler.
+        """
+        new_server = self.replicate_chunk(chunk_id, source, [target])
+        if new_server is None:
             return False
-        else:
-            possible_replica_servers = list(available_servers)
-
-        success = False
-        for server in current_locations:
-            # Connect to each server to replicate chunk
-            # Check if server is not failed
-
-            # print(f"DEBUG: {server}")
+        self.commit_metadata()
+        return True
 
-            copy_server = server.copy()
-            # Convert copy_server[1] to string and concatenate
-            copy_server = ":".join([copy_server[0], str(copy_server[1])])
-            # print(f"DEBUG: copy = {copy_server}, failed = {self.failed_chunk_servers}")
-            if copy_server in self.failed_chunk_servers:
-                print(f"Server {copy_server} is failed. Skipping...")
-                continue
-
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                if isinstance(server, list):
-                    # server[1] += 1
-                    copy_server = server.copy()
-                    copy_server[1] += 1
-                    copy_server = tuple(copy_server)
-                s.connect(copy_server)
-                request = {
-                    "type": "INCREASE_REPLICATION",
-                    "chunk_id": chunk_id,
-                    "available_servers": possible_replica_servers,
-                }
-                # print(f"DEBUG: Sending request {request} to server {server}")
-                s.sendall(json.dumps(request).encode())
-                # print(f"DEBUG: Sent request to server {server}")
-                response = json.loads(s.recv(1024))
-                # print(f"DEBUG: Received response {response} from server {server}")
-                if response.get("status") == "Error":
-                    print(
-                        f"Failed to increase replication for chunk {chunk_id} on server {server}: {response['message']}.\nTrying next server..."
-                    )
-                elif response.get("status") == "OK":
-                    success = True
-                    new_server_replicated = response.get("new_server")
-                    print(
-                        f"Successfully increased replication for chunk {chunk_id} on server {server}.\nNew replica server: {new_server_replicated}"
-                    )
-                    current_locations.append(new_server_replicated)
-                    self.chunk_locations[chunk_id] = current_locations
-                    # print(f"DEBUG: Updated chunk locations: {self.chunk_locations}")
-                    self.save_metadata(self.chunk_locations, "chunk_locations.json")
-                    break
-                else:
-                    print(
-                        f"Unexpected response from server {server}: {response['status']}"
-                    )
+    def replicate_chunk(self, chunk_id, server, possible_replica_servers):
+        """
+        Ask server to copy its replica of a chunk to one of the given servers and
+        record the new location. Returns the new replica server or None.
+        """
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            # Chunk servers take replication requests on port + 1
+            s.connect((server[0], server[1] + 1))
+            request = {
+                "type": "INCREASE_REPLICATION",
+                "chunk_id": chunk_id,
+                "available_servers": possible_replica_servers,
+            }
+            # print(f"DEBUG: Sending request {request} to server {server}")
+            send_message(s, request)
+            # print(f"DEBUG: Sent request to server {server}")
+            response = recv_message(s)
+            # print(f"DEBUG: Received response {response} from server {server}")
 
-        if not success:
-            print("INC_REPL: Failed to increase replication for chunk {chunk_id}")
-            return False
-        else:
-            print(f"INC_REPL: Successfully increased replication for chunk {chunk_id}")
-            return True
+        if response.get("status") == "Error":
+            print(
+                f"Failed to increase replication for chunk {chunk_id} on server {server}: {response['message']}."
+            )
+            return None
+        elif response.get("status") != "OK":
+            print(f"Unexpected response from server {server}: {response['status']}")
+            return None
+
+        new_server_replicated = list(response.get("new_server"))
+        print(
+            f"Successfully increased replication for chunk {chunk_id} on server {server}.\nNew replica server: {new_server_replicated}"
+        )
+        with self.locations_lock:
+            self.set_locations(
+                chunk_id,
+                self.chunk_locations.get(chunk_id, []) + [new_server_replicated],
+            )
+        return new_server_replicated
 
     def handle_rename(self, old_filename, new_filename):
         # Check if the old filename exists
@@ -322,103 +890,238 @@ class MasterServer:
                 "status": "Error",
                 "message": f"File '{new_filename}' already exists",
             }
+        error = self.check_new_file(new_filename)
+        if error:
+            return error
 
         # Perform the renaming in the file metadata
-        self.file_to_chunks[new_filename] = self.file_to_chunks.pop(old_filename)
-
-        # Save the updated metadata to disk
-        self.save_metadata(self.file_to_chunks, "file_to_chunks.json")
+        self.mutate(
+            {
+                "op": "RENAME_FILE",
+                "old_filename": old_filename,
+                "new_filename": new_filename,
+            }
+        )
 
         return {
             "status": "OK",
             "message": f"File '{old_filename}' renamed to '{new_filename}'",
         }
 
+    def check_new_file(self, filename):
+        """
+        Error response if a file cannot be created at filename, otherwise None.
+        """
+        parent, name = self.namespace.split(filename)
+        if not name or self.namespace.is_dir(filename):
+            return {"status": "Error", "message": f"'{filename}' is a directory"}
+        if not self.namespace.is_dir(parent):
+            return {"status": "Error", "message": f"Directory '{parent}' not found"}
+        return None
+
+    def handle_snapshot(self, source, target):
+        """
+        Copy a file by sharing its chunks. Only metadata is written, chunks are
+        copied on the first write to them through either file.
+        """
+        if source not in self.file_to_chunks:
+            return {"status": "Error", "message": f"File '{source}' not found"}
+        if target in self.file_to_chunks:
+            return {"status": "Error", "message": f"File '{target}' already exists"}
+        error = self.check_new_file(target)
+        if error:
+            return error
+
+        self.mutate({"op": "SNAPSHOT_FILE", "source": source, "target": target})
+        return {
+            "status": "OK",
+            "message": f"Snapshot of '{source}' saved as '{target}'",
+        }
+
+    def copy_on_write(self, chunk_id):
+        """
+        Give the writing file its own copy of a chunk shared with a snapshot.
+        Each replica copies the chunk locally under a new id, so no data
+        crosses the network. Returns the new chunk id, or None if no replica
+        could make the copy.
+        """
+        new_chunk_id = self.allocate_chunk_id()
+        # Logged before the copies exist, so chunk reports listing them do not
+        # treat them as garbage
+        self.create_chunk(new_chunk_id, [])
+        copied = []
+        for server in self.chunk_locations.get(chunk_id, []):
+            try:
+                response = call(
+                    server,
+                    inject(
+                        {
+                            "type": "COPY_CHUNK",
+                            "chunk_id": chunk_id,
+                            "new_chunk_id": new_chunk_id,
+                        }
+                    ),
+                )
+            except OSError as e:
+                print(f"Error copying chunk {chunk_id} on {server}: {e}")
+                continue
+            if response and response.get("status") == "OK":
+                copied.append(server)
+
+        if not copied:
+            self.mutate({"op": "DELETE_CHUNK", "chunk_id": new_chunk_id})
+            return None
+
+        self.set_locations(new_chunk_id, copied)
+        self.mutate({"op": "DELETE_CHUNK", "chunk_id": chunk_id})
+        print(f"COW: Chunk {chunk_id} copied to {new_chunk_id} on {copied}")
+
+        if len(copied) < self.replication_factor:
+            self.replication_scheduler.schedule(
+                new_chunk_id, self.replication_factor, len(copied)
+            )
+        return new_chunk_id
+
+    def unshare_chunk(self, filename, index):
+        """
+        Make chunk index of a file private to it before it is written.
+        Returns an error response, or None once the chunk is safe to write.
+        """
+        chunk_ids = self.file_to_chunks[filename]
+        if self.chunk_locations.refcount(chunk_ids[index]) <= 1:
+            return None
+
+        new_chunk_id = self.copy_on_write(chunk_ids[index])
+        if new_chunk_id is None:
+            return {
+                "status": "Error",
+                "message": f"Unable to copy shared chunk {chunk_ids[index]}",
+            }
+        chunk_ids = list(chunk_ids)
+        chunk_ids[index] = new_chunk_id
+        self.mutate({"op": "SET_FILE", "filename": filename, "chunk_ids": chunk_ids})
+        return None
+
+    def handle_mkdir(self, path):
+        if self.namespace.is_dir(path):
+            return {"status": "Error", "message": f"Directory '{path}' already exists"}
+        if path in self.file_to_chunks:
+            return {"status": "Error", "message": f"File '{path}' already exists"}
+        parent, _ = self.namespace.split(path)
+        if not self.namespace.is_dir(parent):
+            return {"status": "Error", "message": f"Directory '{parent}' not found"}
+
+        self.mutate({"op": "MKDIR", "path": path})
+        return {"status": "OK", "message": f"Directory '{path}' created"}
+
+    def handle_ls(self, path):
+        entries = self.namespace.listdir(path)
+        if entries is None:
+            return {"status": "Error", "message": f"Directory '{path}' not found"}
+        return {
+            "status": "OK",
+            "entries": [
+                {"name": name, "type": "directory" if is_dir else "file"}
+                for name, is_dir in entries
+            ],
+        }
+
     def handle_delete(self, filename):
         """Handle deletion of a file and its chunks from the distributed system."""
         if filename not in self.file_to_chunks:
             return {"status": "File Not Found"}
 
         # Retrieve the chunk IDs associated with the file
-        chunk_ids = self.file_to_chunks.pop(filename, [])
+        chunk_ids = self.file_to_chunks[filename]
+        self.mutate({"op": "DELETE_FILE", "filename": filename})
 
         # Delete the associated chunks from chunk locations and servers
         self.delete_old_chunks(chunk_ids)
 
-        # Save updated metadata
-        self.save_metadata(self.file_to_chunks, "file_to_chunks.json")
-        self.save_metadata(self.chunk_locations, "chunk_locations.json")
-
         return {
             "status": "OK",
             "message": f"File '{filename}' and associated chunks deleted",
         }
 
-    def retrying_append(self, filename, data):
-        if not data:
+    def retrying_append(self, filename, length):
+        if not length:
             return {"status": "Error", "message": "No data provided for writing"}
 
-        with self.lock:
-            chunk_id = self.next_chunk_id
-            self.next_chunk_id += 1
-
-            # Split file into chunks of 64MB
-            chunks = self.split_into_chunks(data)
-            if filename not in self.file_to_chunks:
-                self.file_to_chunks[filename] = []
+        if filename not in self.file_to_chunks:
+            error = self.check_new_file(filename)
+            if error:
+                return error
 
-            if len(self.chunk_servers) < self.replication_factor:
-                return {
-                    "status": "Error",
-                    "message": "Not enough chunk servers available",
-                }
+        # Number of chunks needed to hold the appended bytes
+        chunk_size = self.file_chunk_size(filename)
+        num_chunks = self.count_chunks(length, chunk_size)
 
-            chunk_ids = []
-            primary_servers = []
-            for i, chunk_data in enumerate(chunks):
-                chunk_id = self.next_chunk_id
-                self.next_chunk_id += 1
+        # Select a primary chunk server and two other replicas for each chunk
+        placements = self.place_chunks(num_chunks)
+        if placements is None:
+            return {
+                "status": "Error",
+                "message": "Not enough chunk servers available",
+            }
 
-                # Randomly select a primary chunk server and two other replicas
-                random.shuffle(self.chunk_servers)
-                primary_server = self.chunk_servers[0]
-                secondary_servers = self.chunk_servers[1:3]
+        chunk_ids = []
+        primary_servers = []
+        for primary_server, secondary_servers in placements:
+            chunk_id = self.allocate_chunk_id()
 
-                # Save chunk locations
-                self.chunk_locations[chunk_id] = [primary_server] + secondary_servers
+            # Save chunk locations
+            self.create_chunk(chunk_id, [primary_server] + secondary_servers)
+            self.mutate(
+                {"op": "APPEND_CHUNK", "filename": filename, "chunk_id": chunk_id}
+            )
 
-                self.file_to_chunks[filename].append(chunk_id)
+            # Distribute chunks across the chunk servers
+            print(
+                f"Assigned chunk {chunk_id} to primary {primary_server}, replicas: {secondary_servers}"
+            )
 
-                # Distribute chunks across the chunk servers
-                print(
-                    f"Assigned chunk {chunk_id} to primary {primary_server}, replicas: {secondary_servers}"
-                )
-                self.save_metadata(self.file_to_chunks, "file_to_chunks.json")
-                self.save_metadata(self.chunk_locations, "chunk_locations.json")
+            chunk_ids.append(chunk_id)
+            primary_servers.append(primary_server)
 
-                chunk_ids.append(chunk_id)
-                primary_servers.append(primary_server)
+        self.grant_mutation(chunk_ids)
+        # Now send the response including 'primary_servers' key
+        return {
+            "status": "OK",
+            "chunk_ids": chunk_ids,
+            "primary_servers": primary_servers,  # Different primary for each chunk
+            "locations": [
+                self.chunk_locations[chunk_id] for chunk_id in chunk_ids
+            ],  # Locations for each chunk
+            "chunk_size": chunk_size,
+        }
 
-            # Now send the response including 'primary_servers' key
-            return {
-                "status": "OK",
-                "chunk_ids": chunk_ids,
-                "primary_servers": primary_servers,  # Different primary for each chunk
-                "locations": [
-                    self.chunk_locations[chunk_id] for chunk_id in chunk_ids
-                ],  # Locations for each chunk
-            }
+    def handle_register_chunkserver(self, chunkserver_address, inventory=None):
+        """
+        Add a chunk server and take its chunk inventory as the truth about
+        the chunks it holds. Returns the chunks it should delete.
+        """
+        self.add_chunk_server(chunkserver_address)
+        print(f"Chunk server registered: {chunkserver_address}")
+        if inventory is None:
+            return []
+        report = self.handle_chunk_report(
+            self.get_server_id(chunkserver_address), inventory
+        )
+        return report["garbage"]
 
-    def handle_register_chunkserver(self, chunkserver_address):
+    def add_chunk_server(self, chunkserver_address):
         with self.lock:
             if chunkserver_address not in self.chunk_servers:
                 self.chunk_servers.append(chunkserver_address)
-            print(f"Chunk server registered: {chunkserver_address}")
 
-    def handle_record_append(self, filename, data):
+    def handle_record_append(self, filename):
         if filename not in self.file_to_chunks:
             return {"status": "Error", "message": "File not found"}
 
+        error = self.unshare_chunk(filename, -1)
+        if error:
+            return error
+
         last_chunk_id = self.file_to_chunks[filename][-1]
         last_chunk_location = self.chunk_locations.get(last_chunk_id, [])
         if not last_chunk_location:
@@ -428,11 +1131,13 @@ class MasterServer:
             }
 
         # Send back last chunk metadata
+        self.grant_mutation([last_chunk_id])
         response = {
             "status": "OK",
             "last_chunk_id": last_chunk_id,
             "primary_server": last_chunk_location[0],
             "secondary_servers": last_chunk_location[1:],
+            "chunk_size": self.file_chunk_size(filename),
         }
         return response
 
@@ -453,78 +1158,263 @@ class MasterServer:
 
         return {"status": "OK", "chunks": chunks, "locations": locations}
 
-    def handle_write(self, filename, data):
-        if not data:
+    def handle_batch_lookup(self, files):
+        """
+        Resolve chunk handles and locations for many files in one request.
+        Each entry is either a filename or a dict with "filename" and an
+        optional chunk index range "start" (inclusive) to "end" (exclusive).
+        """
+        results = []
+        for entry in files:
+            if isinstance(entry, str):
+                entry = {"filename": entry}
+            filename = entry.get("filename")
+            path = self.namespace.normalize(filename or "")
+            with self.namespace.locked(read=[path]):
+                all_chunks = list(self.file_to_chunks.get(path, ()))
+                found = path in self.file_to_chunks
+            if not found:
+                results.append({"filename": filename, "status": "File Not Found"})
+                continue
+
+            start = max(0, entry.get("start", 0))
+            end = entry.get("end")
+            end = len(all_chunks) if end is None else min(end, len(all_chunks))
+            chunks = all_chunks[start:end]
+
+            locations = []
+            for chunk in chunks:
+                self.record_chunk_access(chunk)
+                locations.append(self.chunk_locations.get(chunk, []))
+
+            results.append(
+                {
+                    "filename": filename,
+                    "status": "OK",
+                    "start": start,
+                    "num_chunks": len(all_chunks),
+                    "chunks": chunks,
+                    "locations": locations,
+                }
+            )
+
+        return {"status": "OK", "results": results}
+
+    def handle_write(self, filename, length, chunk_size=None):
+        if not length:
             return {"status": "Error", "message": "No data provided for writing"}
 
-        with self.lock:
-            chunk_id = self.next_chunk_id
-            self.next_chunk_id += 1
+        if filename not in self.file_to_chunks:
+            error = self.check_new_file(filename)
+            if error:
+                return error
 
-            # Split file into chunks of 64MB
-            chunks = self.split_into_chunks(data)
+        if chunk_size is None:
+            chunk_size = self.file_chunk_size(filename)
+        else:
+            error = self.check_chunk_size(chunk_size)
+            if error:
+                return error
 
-            # Remove old chunks associated with the file from metadata and servers
-            if filename in self.file_to_chunks:
-                old_chunk_ids = self.file_to_chunks[filename]
-                self.delete_old_chunks(old_chunk_ids)
+        # Number of chunks needed to hold the written bytes
+        num_chunks = self.count_chunks(length, chunk_size)
 
-            self.file_to_chunks[filename] = []
+        # Select a primary chunk server and two other replicas for each chunk
+        placements = self.place_chunks(num_chunks)
+        if placements is None:
+            return {
+                "status": "Error",
+                "message": "Not enough chunk servers available",
+            }
 
-            if len(self.chunk_servers) < self.replication_factor:
-                return {
-                    "status": "Error",
-                    "message": "Not enough chunk servers available",
-                }
+        # Remove old chunks associated with the file from metadata
+        if filename in self.file_to_chunks:
+            old_chunk_ids = self.file_to_chunks[filename]
+            self.mutate({"op": "SET_FILE", "filename": filename, "chunk_ids": []})
+            self.delete_old_chunks(old_chunk_ids)
 
-            chunk_ids = []
-            primary_servers = []
-            for i, chunk_data in enumerate(chunks):
-                chunk_id = self.next_chunk_id
-                self.next_chunk_id += 1
+        chunk_ids = []
+        primary_servers = []
+        for primary_server, secondary_servers in placements:
+            chunk_id = self.allocate_chunk_id()
 
-                # Randomly select a primary chunk server and two other replicas
-                random.shuffle(self.chunk_servers)
-                primary_server = self.chunk_servers[0]
-                secondary_servers = self.chunk_servers[1:3]
+            # Save chunk locations
+            self.create_chunk(chunk_id, [primary_server] + secondary_servers)
 
-                # Save chunk locations
-                self.chunk_locations[chunk_id] = [primary_server] + secondary_servers
-                self.file_to_chunks[filename].append(chunk_id)
+            # Distribute chunks across the chunk servers
+            print(
+                f"Assigned chunk {chunk_id} to primary {primary_server}, replicas: {secondary_servers}"
+            )
 
-                # Distribute chunks across the chunk servers
-                print(
-                    f"Assigned chunk {chunk_id} to primary {primary_server}, replicas: {secondary_servers}"
-                )
-                self.save_metadata(self.file_to_chunks, "file_to_chunks.json")
-                self.save_metadata(self.chunk_locations, "chunk_locations.json")
+            chunk_ids.append(chunk_id)
+            primary_servers.append(primary_server)
 
-                chunk_ids.append(chunk_id)
-                primary_servers.append(primary_server)
+        record = {"op": "SET_FILE", "filename": filename, "chunk_ids": chunk_ids}
+        if chunk_size != self.file_chunk_size(filename):
+            # The default is not stored per file
+            record["chunk_size"] = None if chunk_size == self.chunk_size else chunk_size
+        self.mutate(record)
+        self.grant_mutation(chunk_ids)
 
-            # print(f"DEBUG: Write locations: {self.chunk_locations}")
+        # print(f"DEBUG: Write locations: {self.chunk_locations}")
 
-            return {
-                "status": "OK",
-                "chunk_ids": chunk_ids,
-                "primary_servers": primary_servers,
-                "locations": [self.chunk_locations[chunk_id] for chunk_id in chunk_ids],
-            }
+        return {
+            "status": "OK",
+            "chunk_ids": chunk_ids,
+            "primary_servers": primary_servers,
+            "locations": [self.chunk_locations[chunk_id] for chunk_id in chunk_ids],
+            "chunk_size": chunk_size,
+        }
 
     def delete_old_chunks(self, old_chunk_ids):
-        """Delete old chunks and their replicas from chunk locations and servers."""
-        print(old_chunk_ids, self.chunk_locations)
-        for i in range(len(old_chunk_ids)):
-            chunk_id = old_chunk_ids[i]
-            servers = self.chunk_locations.pop(chunk_id)
-            self.remove_chunk_from_servers(chunk_id, servers)
+        """
+        Drop old chunks from the metadata. Their replicas become garbage that
+        chunk servers remove after their next chunk report.
+        """
+        for chunk_id in old_chunk_ids:
+            self.mutate({"op": "DELETE_CHUNK", "chunk_id": chunk_id})
+
+    def handle_chunk_report(self, chunk_server_id, inventory):
+        """
+        Rebuild the locations on a server from its full chunk inventory and
+        return the chunks it should delete.
 
-        # Save updated mappings
-        self.save_metadata(self.chunk_locations, "chunk_locations.json")
-        self.save_metadata(self.file_to_chunks, "file_to_chunks.json")
+        Chunks missing from the metadata were deleted and are garbage right
+        away, chunk ids are never reused. A replica of a live chunk that
+        already has enough replicas elsewhere, e.g. on a server that was
+        declared failed and came back, is garbage as well.
+        """
+        self.add_chunk_server(self.get_server_list(chunk_server_id))
+
+        garbage = []
+        reported = set()
+        for chunk_id in inventory.get("chunk_ids", []):
+            if chunk_id not in self.chunk_locations:
+                if chunk_id < self.next_chunk_id:
+                    garbage.append(chunk_id)
+            elif self.add_location(chunk_id, chunk_server_id):
+                reported.add(chunk_id)
+            else:
+                garbage.append(chunk_id)
+
+        # Chunks the master placed on the server that it no longer holds
+        self.prune_mutation_grants()
+        for chunk_id in self.chunk_locations.chunks_on(chunk_server_id):
+            if chunk_id not in reported and chunk_id not in self.mutation_grants:
+                self.remove_location(chunk_id, chunk_server_id)
+
+        self.inventory_versions[chunk_server_id] = inventory.get("version")
+        self.inventory_bytes[chunk_server_id] = sum(inventory.get("sizes", []))
+        self.commit_metadata()
+
+        self.gc_stats["reports"] += 1
+        self.gc_stats["collected"] += len(garbage)
+        if garbage:
+            print(f"GC: Chunk server {chunk_server_id} to delete chunks {garbage}")
+        return {"status": "OK", "garbage": garbage}
+
+    def grant_mutation(self, chunk_ids):
+        """Note that clients were sent the locations of chunks to write."""
+        now = time()
+        for chunk_id in chunk_ids:
+            self.mutation_grants[chunk_id] = now
+
+    def prune_mutation_grants(self):
+        expired = time() - self.mutation_grace
+        for chunk_id, granted in list(self.mutation_grants.items()):
+            if granted < expired:
+                self.mutation_grants.pop(chunk_id, None)
+
+    def apply_inventory_delta(self, chunk_server_id, delta):
+        """
+        Apply the chunks a server added or removed since its previous
+        heartbeat. A delta that does not follow the last applied inventory
+        version means heartbeats were lost, so a full report is pulled.
+        """
+        known = self.inventory_versions.get(chunk_server_id)
+        if known is None or delta.get("base") != known:
+            if known != delta.get("version"):
+                self.request_chunk_report(chunk_server_id)
+            return
+
+        for chunk_id, _ in delta.get("added", []):
+            if chunk_id in self.chunk_locations:
+                self.add_location(chunk_id, chunk_server_id)
+        for chunk_id in delta.get("removed", []):
+            if chunk_id in self.chunk_locations:
+                self.remove_location(chunk_id, chunk_server_id)
+        self.inventory_versions[chunk_server_id] = delta["version"]
+        self.commit_metadata()
+
+    def request_chunk_report(self, chunk_server_id):
+        if chunk_server_id in self.pending_reports:
+            return
+        self.pending_reports.add(chunk_server_id)
+        threading.Thread(
+            target=self.pull_chunk_report, args=(chunk_server_id,), daemon=True
+        ).start()
+
+    def pull_chunk_report(self, chunk_server_id):
+        """
+        Ask a chunk server for its full inventory on its master port.
+        """
+        try:
+            host, port = self.get_server_list(chunk_server_id)
+            response = call((host, port + 1), {"type": "REPORT_CHUNKS"}, timeout=30)
+            self.handle_chunk_report(chunk_server_id, response["inventory"])
+            print(f"Pulled chunk report from chunk server {chunk_server_id}")
+        except Exception as e:
+            print(f"Error pulling chunk report from {chunk_server_id}: {e}")
+        finally:
+            self.pending_reports.discard(chunk_server_id)
+
+    def replica_target(self, chunk_id):
+        """Replicas a chunk should have, counting extra ones for hot chunks."""
+        return max(
+            self.replication_factor,
+            self.chunk_modified_replication.get(chunk_id, 0),
+            self.replication_scheduler.desired.get(chunk_id, 0),
+        )
+
+    def add_location(self, chunk_id, chunk_server_id):
+        """
+        Record a reported replica. Returns False if the chunk has enough
+        replicas elsewhere and this one is excess.
+        """
+        with self.locations_lock:
+            servers = self.chunk_locations.get(chunk_id, [])
+            if any(self.get_server_id(server) == chunk_server_id for server in servers):
+                return True
+            if len(servers) >= self.replica_target(chunk_id):
+                return False
+            self.set_locations(
+                chunk_id, servers + [self.get_server_list(chunk_server_id)]
+            )
+            return True
+
+    def remove_location(self, chunk_id, chunk_server_id):
+        """
+        Forget a replica the server no longer holds and restore the
+        replication factor from the remaining ones.
+        """
+        with self.locations_lock:
+            located = self.chunk_locations.get(chunk_id, [])
+            servers = [
+                server
+                for server in located
+                if self.get_server_id(server) != chunk_server_id
+            ]
+            if len(servers) == len(located):
+                return
+            self.set_locations(chunk_id, servers)
+        if servers and len(servers) < self.replication_factor:
+            self.replication_scheduler.schedule(
+                chunk_id, self.replication_factor, len(servers)
+            )
 
     def remove_chunk_from_servers(self, chunk_id, servers):
-        """Delete chunk data from primary and replica servers."""
+        """Delete chunk data from primary and replica servers. Returns bytes freed."""
+        freed_bytes = 0
         for server in servers:
             if isinstance(
                 server, list
@@ -535,18 +1425,60 @@ class MasterServer:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
                 s.connect(server)  # server should be a tuple (host, port)
                 request = {"type": "DELETE_CHUNK", "chunk_id": chunk_id}
-                s.send(json.dumps(request).encode())
-                response = json.loads(s.recv(1024))
+                send_message(s, inject(request))
+                response = recv_message(s)
                 print(
                     f"Deleted chunk {chunk_id} from server {server}: {response['status']}"
                 )
+                freed_bytes += response.get("bytes", 0)
+        return freed_bytes
 
-    def split_into_chunks(self, data):
-        """Split data into chunks of size self.chunk_size"""
-        chunks = [
-            data[i : i + self.chunk_size] for i in range(0, len(data), self.chunk_size)
-        ]
-        return chunks
+    def count_chunks(self, length, chunk_size):
+        """Number of chunks of size chunk_size needed for length bytes"""
+        return -(-length // chunk_size)
+
+    def file_chunk_size(self, filename):
+        return self.file_chunk_sizes.get(filename, self.chunk_size)
+
+    def check_chunk_size(self, chunk_size):
+        """
+        Error response if a requested file chunk size is not usable,
+        otherwise None. The size is logged with the SET_FILE that lays out
+        the file's chunks at it.
+        """
+        if not isinstance(chunk_size, int) or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            return {
+                "status": "Error",
+                "message": f"Chunk size must be between 1 and {MAX_CHUNK_SIZE} bytes",
+            }
+        return None
+
+    def adopt_chunk_size(self):
+        """
+        Keep the layout of files written under another default chunk size
+        when the master starts with a new one.
+        """
+        previous = self.logged_chunk_size
+        if previous == self.chunk_size:
+            return
+        if previous is None and self.file_to_chunks:
+            previous = 12  # Chunk size before it became configurable
+        if previous is not None:
+            for filename in self.file_to_chunks:
+                size = self.file_chunk_sizes.get(filename, previous)
+                stored = None if size == self.chunk_size else size
+                if stored != self.file_chunk_sizes.get(filename):
+                    self.mutate(
+                        {"op": "SET_CHUNK_SIZE", "filename": filename, "chunk_size": stored}
+                    )
+        self.mutate({"op": "SET_DEFAULT_CHUNK_SIZE", "chunk_size": self.chunk_size})
+        self.commit_metadata()
+
+    def cluster_config(self):
+        return {
+            "chunk_size": self.chunk_size,
+            "replication_factor": self.replication_factor,
+        }
 
     def get_last_chunk_size(self, filename):
         # Retrieve the chunk IDs for the file
@@ -580,10 +1512,10 @@ class MasterServer:
                 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as chunk_socket:
                     chunk_socket.connect(server)  # Connect to the server
                     request = {"type": "GET_CHUNK_SIZE", "chunk_id": last_chunk_id}
-                    chunk_socket.send(json.dumps(request).encode())
+                    send_message(chunk_socket, inject(request))
 
                     # Receive the response from the chunk server
-                    response = json.loads(chunk_socket.recv(1024))
+                    response = recv_message(chunk_socket)
                     if response.get("status") == "OK":
                         chunk_size = response.get("chunk_size")
                         print(f"Chunk size for chunk {last_chunk_id}: {chunk_size}")
@@ -606,7 +1538,7 @@ class MasterServer:
 
         return {"status": "OK", "chunk_size": content}
 
-    def handle_write_offset(self, filename, data, offset):
+    def handle_write_offset(self, filename, length, offset):
         if filename not in self.file_to_chunks:
             return {"status": "Error", "message": "File not found"}
 
@@ -616,9 +1548,10 @@ class MasterServer:
         updated_chunk_info = []
 
         # Calculate the chunk and position within the chunk for the offset
-        chunk_index = offset // self.chunk_size
+        chunk_size = self.file_chunk_size(filename)
+        chunk_index = offset // chunk_size
 
-        chunk_offset = offset % self.chunk_size
+        chunk_offset = offset % chunk_size
 
         last_chunk_size_response = self.get_last_chunk_size(filename)
         if last_chunk_size_response["status"] != "OK":
@@ -632,20 +1565,35 @@ class MasterServer:
             chunk_offset = (
                 last_chunk_size  # Start appending from the end of the last chunk
             )
-        # Remove chunks beyond the offset
 
+        # Bytes that do not fit in the chunk at the offset go to new chunks
+        overflow = length - max(0, min(length, chunk_size - chunk_offset))
+        placements = self.place_chunks(self.count_chunks(overflow, chunk_size))
+        if placements is None:
+            return {
+                "status": "Error",
+                "message": "Not enough chunk servers available",
+            }
+
+        # The chunk written first may be shared with a snapshot
+        error = self.unshare_chunk(filename, chunk_index)
+        if error:
+            return error
+        chunk_ids = self.file_to_chunks[filename]
+
+        # Remove chunks beyond the offset
         chunks_to_delete = chunk_ids[chunk_index + 1 :]
         self.delete_old_chunks(chunks_to_delete)
         chunk_ids = chunk_ids[: chunk_index + 1]
 
         # Handle writing starting at the specified offset
         for idx, chunk_id in enumerate(chunk_ids[chunk_index:], start=chunk_index):
-            data_to_write = data[
-                total_data_written : total_data_written + self.chunk_size - chunk_offset
-            ]
-            total_data_written += len(data_to_write)
+            write_size = min(
+                length - total_data_written, chunk_size - chunk_offset
+            )
+            total_data_written += write_size
 
-            if not data_to_write:
+            if write_size <= 0:
                 break
 
             # Add updated chunk details
@@ -660,26 +1608,17 @@ class MasterServer:
             chunk_offset = 0  # Reset offset after the first chunk
 
         # Allocate new chunks if needed
-        while total_data_written < len(data):
-            new_chunk_id = self.next_chunk_id
-            self.next_chunk_id += 1
+        for primary_server, secondary_servers in placements:
+            new_chunk_id = self.allocate_chunk_id()
 
-            # primary_server = random.choice(self.chunk_servers)
-            random.shuffle(self.chunk_servers)
-            primary_server = self.chunk_servers[0]
-            secondary_servers = self.chunk_servers[1:3]
-            self.chunk_locations[new_chunk_id] = [primary_server] + secondary_servers
-            self.file_to_chunks[filename].append(new_chunk_id)
+            self.create_chunk(new_chunk_id, [primary_server] + secondary_servers)
             chunk_ids.append(new_chunk_id)
             # Distribute chunks across the chunk servers
             print(
                 f"Assigned chunk {new_chunk_id} to primary {primary_server}, replicas: {secondary_servers}"
             )
 
-            data_to_write = data[
-                total_data_written : total_data_written + self.chunk_size
-            ]
-            total_data_written += len(data_to_write)
+            total_data_written += min(length - total_data_written, chunk_size)
 
             updated_chunk_info.append(
                 {
@@ -691,55 +1630,138 @@ class MasterServer:
             )
 
         # Save metadata
-        self.file_to_chunks[filename] = chunk_ids
-        self.save_metadata(self.file_to_chunks, "file_to_chunks.json")
-        self.save_metadata(self.chunk_locations, "chunk_locations.json")
+        self.mutate({"op": "SET_FILE", "filename": filename, "chunk_ids": chunk_ids})
+        self.grant_mutation([chunk["chunk_id"] for chunk in updated_chunk_info])
 
-        return {"status": "OK", "chunk_info": updated_chunk_info}
+        return {
+            "status": "OK",
+            "chunk_info": updated_chunk_info,
+            "chunk_size": chunk_size,
+        }
 
-    def record_chunk_access(self, chunk_id):
+    def cool_down_replicas(self):
         """
-        Record the access time for a chunk and increase replication if necessary.
+        Periodically shrink dynamically added replicas back toward the
+        replication factor once a chunk's access rate stays low.
         """
-        current_time = time()
-
-        if not chunk_id in self.chunk_access_times:
-            self.chunk_access_times[chunk_id] = []
+        while True:
+            sleep(self.cooldown_interval)
+            try:
+                for chunk_id in list(self.chunk_modified_replication):
+                    if self.hot_chunks.count(chunk_id) >= self.cooldown_threshold:
+                        self.cold_checks.pop(chunk_id, None)
+                        continue
+
+                    self.cold_checks[chunk_id] = self.cold_checks.get(chunk_id, 0) + 1
+                    if self.cold_checks[chunk_id] >= self.cooldown_checks:
+                        self.shrink_replicas(chunk_id)
+            except Exception as e:
+                print(f"Error cooling down replicas: {e}")
 
-        self.chunk_access_times[chunk_id].append(current_time)
+    def shrink_replicas(self, chunk_id):
+        """
+        Remove replicas above the replication factor, most loaded servers first.
+        The primary replica is always kept.
+        """
+        self.replication_scheduler.cancel(chunk_id)
+        self.chunk_modified_replication.pop(chunk_id, None)
+        self.cold_checks.pop(chunk_id, None)
+
+        servers = self.chunk_locations.get(chunk_id)
+        if servers is None or len(servers) <= self.replication_factor:
+            return
+
+        def load(server):
+            stats = self.heartbeat_data.get(self.get_server_id(server), {})
+            capacity = stats.get("capacity_bytes") or 0
+            used = 1 - stats.get("free_bytes", 0) / capacity if capacity else 0
+            return (stats.get("num_requests", 0), used)
+
+        primary, secondaries = servers[0], servers[1:]
+        secondaries.sort(key=load, reverse=True)
+        extra = len(servers) - self.replication_factor
+        removed, kept = secondaries[:extra], secondaries[extra:]
+
+        self.set_locations(chunk_id, [primary] + kept)
+        self.commit_metadata()
+
+        freed_bytes = self.remove_chunk_from_servers(chunk_id, removed)
+        self.cooldown_stats["replicas_removed"] += len(removed)
+        self.cooldown_stats["bytes_reclaimed"] += freed_bytes
+        print(
+            f"COOLDOWN: Chunk {chunk_id} back to {len(kept) + 1} replicas, reclaimed {freed_bytes} bytes from {removed}"
+        )
 
-        self.chunk_access_times[chunk_id] = [
-            ts
-            for ts in self.chunk_access_times[chunk_id]
-            if current_time - ts < self.threshold_timeout
-        ]
+    def record_chunk_access(self, chunk_id):
+        """
+        Count an access to a chunk and queue an extra replica when it runs hot.
+        The copy itself happens on the replication scheduler, off the read path.
+        """
+        accesses = self.hot_chunks.record(chunk_id)
 
         if chunk_id not in self.chunk_modified_replication:
-            if len(self.chunk_access_times[chunk_id]) > self.max_request_threshold:
-                # print(
-                #     f"DEBUG: Chunk {chunk_id} accessed {len(self.chunk_access_times[chunk_id])} times"
-                # )
-                self.chunk_modified_replication[chunk_id] = 4
-                req_resp = self.handle_increase_replication(chunk_id)
+            if accesses <= self.max_request_threshold:
+                return
+            # print(f"DEBUG: Chunk {chunk_id} accessed {accesses} times")
+            desired = self.replication_factor + 1
         else:
-            if (
-                len(self.chunk_access_times[chunk_id])
-                > self.chunk_modified_replication[chunk_id]
-            ):
-                # print(
-                #     f"DEBUG: Chunk {chunk_id} accessed {len(self.chunk_access_times[chunk_id])} times. Modified replication: {self.chunk_modified_replication[chunk_id]}"
-                # )
-                self.chunk_modified_replication[chunk_id] += 1
-                req_resp = self.handle_increase_replication(chunk_id)
-
-        # print(
-        #     f"Chunk access times: {self.chunk_access_times}, Chunk modified replication: {self.chunk_modified_replication.get(chunk_id, 0)}"
-        # )
-        return
+            if accesses <= self.chunk_modified_replication[chunk_id]:
+                return
+            # print(
+            #     f"DEBUG: Chunk {chunk_id} accessed {accesses} times. Modified replication: {self.chunk_modified_replication[chunk_id]}"
+            # )
+            desired = self.chunk_modified_replication[chunk_id] + 1
+
+        # More replicas than chunk servers cannot be placed
+        desired = min(desired, len(self.chunk_servers))
+        if desired <= self.chunk_modified_replication.get(chunk_id, 0):
+            return
+        self.chunk_modified_replication[chunk_id] = desired
+
+        live, _ = self.plan_replication(chunk_id)
+        self.replication_scheduler.schedule(chunk_id, desired, len(live))
 
 
 if __name__ == "__main__":
-    master_host = "127.0.0.1"
-    master_port = 5000
-    master_server = MasterServer(master_host, master_port)
-    master_server.start()
+    parser = argparse.ArgumentParser(description="GFS master server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--root-dir", default="master_metadata")
+    parser.add_argument(
+        "--chunk-size", type=int, default=12, help="Default chunk size in bytes"
+    )
+    parser.add_argument(
+        "--replication-factor", type=int, default=3, help="Replicas of every chunk"
+    )
+    parser.add_argument(
+        "--placement",
+        choices=sorted(PLACEMENT_POLICIES),
+        default="load_aware",
+        help="Policy used to choose servers for new chunks",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Serve clients from an asyncio event loop",
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, help="Port of the HTTP /metrics endpoint"
+    )
+    parser.add_argument("--trace-dir", help="Write spans of traced requests here")
+    args = parser.parse_args()
+
+    master_server = MasterServer(
+        args.host,
+        args.port,
+        root_dir=args.root_dir,
+        chunk_size=args.chunk_size,
+        replication_factor=args.replication_factor,
+        placement=args.placement,
+        metrics_port=args.metrics_port,
+        trace_dir=args.trace_dir,
+    )
+    if args.use_async:
+        master_server.start_async()
+    else:
+        master_server.start()
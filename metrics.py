@@ -0,0 +1,176 @@
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds, Prometheus "le" buckets
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+MAX_LABELS = 64  # Distinct request types or disk operations, later ones count as "other"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels, lines):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+
+
+class CountingSocket:
+    """
+    Socket proxy counting the bytes sent through it, for handlers that
+    send their own responses.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.bytes_sent = 0
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+        self.bytes_sent += len(data)
+
+    def sendfile(self, file, offset=0, count=None):
+        sent = self.sock.sendfile(file, offset, count)
+        self.bytes_sent += sent
+        return sent
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class Metrics:
+    """
+    Request and disk operation statistics of one server process.
+
+    Every request records its latency in a histogram and the bytes it
+    received and sent, keyed by request type. Disk operations record their
+    latency and the bytes they moved, keyed by operation. Recording takes a
+    single lock and a bucket search. render() produces the Prometheus text
+    exposition format, served over HTTP by serve().
+    """
+
+    def __init__(self, component):
+        self.component = component
+        self.lock = threading.Lock()
+        self.requests = {}  # Request type -> [Histogram, bytes in, bytes out]
+        self.disk = {}  # Disk operation -> [Histogram, bytes]
+
+    def label(self, table, name):
+        if name in table or len(table) < MAX_LABELS:
+            return name
+        return "other"
+
+    def observe_request(self, request, seconds, bytes_in, bytes_out):
+        with self.lock:
+            request = self.label(self.requests, str(request))
+            entry = self.requests.get(request)
+            if entry is None:
+                entry = self.requests[request] = [Histogram(), 0, 0]
+            entry[0].observe(seconds)
+            entry[1] += bytes_in
+            entry[2] += bytes_out
+
+    def observe_disk(self, operation, seconds, size=0):
+        with self.lock:
+            operation = self.label(self.disk, operation)
+            entry = self.disk.get(operation)
+            if entry is None:
+                entry = self.disk[operation] = [Histogram(), 0]
+            entry[0].observe(seconds)
+            entry[1] += size
+
+    @contextmanager
+    def timed_disk(self, operation, size=0):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_disk(operation, perf_counter() - start, size)
+
+    def render(self):
+        component = f'component="{self.component}"'
+        lines = []
+        with self.lock:
+            lines.append(
+                "# HELP gfs_request_duration_seconds Time to handle a request, by request type."
+            )
+            lines.append("# TYPE gfs_request_duration_seconds histogram")
+            for request, (histogram, _, _) in sorted(self.requests.items()):
+                histogram.render(
+                    "gfs_request_duration_seconds",
+                    f'{component},type="{request}"',
+                    lines,
+                )
+            lines.append(
+                "# HELP gfs_request_bytes_total Request and response bytes, by request type."
+            )
+            lines.append("# TYPE gfs_request_bytes_total counter")
+            for request, (_, bytes_in, bytes_out) in sorted(self.requests.items()):
+                labels = f'{component},type="{request}"'
+                lines.append(f'gfs_request_bytes_total{{{labels},direction="in"}} {bytes_in}')
+                lines.append(f'gfs_request_bytes_total{{{labels},direction="out"}} {bytes_out}')
+
+            lines.append(
+                "# HELP gfs_disk_duration_seconds Time spent in disk operations, by operation."
+            )
+            lines.append("# TYPE gfs_disk_duration_seconds histogram")
+            for operation, (histogram, _) in sorted(self.disk.items()):
+                histogram.render(
+                    "gfs_disk_duration_seconds",
+                    f'{component},operation="{operation}"',
+                    lines,
+                )
+            lines.append("# HELP gfs_disk_bytes_total Bytes moved by disk operations.")
+            lines.append("# TYPE gfs_disk_bytes_total counter")
+            for operation, (_, size) in sorted(self.disk.items()):
+                lines.append(
+                    f'gfs_disk_bytes_total{{{component},operation="{operation}"}} {size}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host, port):
+        """
+        Serve render() at /metrics on a background thread.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes would flood the server output
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Metrics available at http://{host}:{port}/metrics")
+        return server
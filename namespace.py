@@ -0,0 +1,176 @@
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """
+    Many readers or a single writer. Waiting writers block new readers so a
+    steady stream of reads cannot starve them.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    def acquire_read(self, blocking=True):
+        with self.condition:
+            while self.writer or self.waiting_writers:
+                if not blocking:
+                    return False
+                self.condition.wait()
+            self.readers += 1
+            return True
+
+    def release_read(self):
+        with self.condition:
+            self.readers -= 1
+            if not self.readers:
+                self.condition.notify_all()
+
+    def acquire_write(self, blocking=True):
+        with self.condition:
+            if not blocking and (self.writer or self.readers):
+                return False
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+            return True
+
+    def release_write(self):
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+
+class Namespace:
+    """
+    Directory tree over the master's file names with per-path locking.
+
+    Paths are normalized to slash-separated names without a leading slash,
+    the root directory being "". Each directory keeps the names of its
+    children so listing it does not scan every file. File metadata itself
+    stays in the master's file_to_chunks map.
+
+    An operation on a path read-locks every ancestor directory and read- or
+    write-locks the path itself, so operations in different directories, or
+    creations of different files in the same directory, run in parallel.
+    Locks are taken ordered by depth and then name to avoid deadlocks and
+    only exist while some operation holds or waits for them.
+    """
+
+    def __init__(self):
+        self.children = {"": set()}  # Directory path -> names of its entries
+        self.lock_table = {}  # Path -> [ReadWriteLock, operations using it]
+        self.table_lock = threading.Lock()
+
+    @staticmethod
+    def normalize(path):
+        return "/".join(part for part in path.split("/") if part)
+
+    @staticmethod
+    def split(path):
+        """Return (parent directory, name) of a normalized path."""
+        parent, _, name = path.rpartition("/")
+        return parent, name
+
+    @staticmethod
+    def ancestors(path):
+        """Directories above a normalized path, root first."""
+        parts = path.split("/")[:-1] if path else []
+        return [""] + ["/".join(parts[: i + 1]) for i in range(len(parts))]
+
+    def is_dir(self, path):
+        return path in self.children
+
+    def listdir(self, path):
+        """Sorted entries of a directory as (name, is_dir) pairs, None if missing."""
+        entries = self.children.get(path)
+        if entries is None:
+            return None
+        prefix = path + "/" if path else ""
+        return [(name, prefix + name in self.children) for name in sorted(entries)]
+
+    def mkdir(self, path):
+        """Create a directory and any missing parents."""
+        if path not in self.children:
+            parent, name = self.split(path)
+            self.children[path] = set()
+            self.mkdir(parent)
+            self.children[parent].add(name)
+
+    def add_file(self, path):
+        parent, name = self.split(path)
+        self.mkdir(parent)
+        self.children[parent].add(name)
+
+    def remove_file(self, path):
+        parent, name = self.split(path)
+        entries = self.children.get(parent)
+        if entries is not None:
+            entries.discard(name)
+
+    def directories(self):
+        """Every directory except the root, parents before children."""
+        return sorted((path for path in self.children if path), key=self.lock_order)
+
+    @staticmethod
+    def lock_order(path):
+        return (path.count("/") + bool(path), path)
+
+    @contextmanager
+    def locked(self, read=(), write=(), blocking=True):
+        """
+        Hold read locks on the read paths, write locks on the write paths and
+        read locks on all of their ancestors for the duration of the block.
+        Yields whether the locks are held, which is only False without
+        blocking when one of them was taken.
+        """
+        modes = {}
+        for path in list(read) + list(write):
+            for ancestor in self.ancestors(path):
+                modes.setdefault(ancestor, "read")
+        for path in read:
+            modes.setdefault(path, "read")
+        for path in write:
+            modes[path] = "write"
+
+        held = []
+        try:
+            acquired = True
+            for path in sorted(modes, key=self.lock_order):
+                lock = self.checkout(path)
+                if modes[path] == "write":
+                    acquired = lock.acquire_write(blocking)
+                else:
+                    acquired = lock.acquire_read(blocking)
+                if not acquired:
+                    self.checkin(path)
+                    break
+                held.append((path, lock, modes[path]))
+            yield acquired
+        finally:
+            for path, lock, mode in reversed(held):
+                if mode == "write":
+                    lock.release_write()
+                else:
+                    lock.release_read()
+                self.checkin(path)
+
+    def checkout(self, path):
+        with self.table_lock:
+            entry = self.lock_table.get(path)
+            if entry is None:
+                entry = self.lock_table[path] = [ReadWriteLock(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def checkin(self, path):
+        with self.table_lock:
+            entry = self.lock_table[path]
+            entry[1] -= 1
+            if not entry[1]:
+                del self.lock_table[path]
@@ -0,0 +1,190 @@
+import os
+import json
+import threading
+from time import perf_counter
+
+from checkpoint import JsonCheckpoint
+
+
+class OperationLog:
+    """
+    Append-only log of metadata mutations with periodic compacted checkpoints.
+
+    Records are appended as JSON lines to oplog_<generation>.log. A checkpoint
+    freezes the current generation, starts a new log file and writes the
+    snapshot in the background; recovery loads the checkpoint and replays
+    every log generation newer than the one it covers.
+
+    codec encodes checkpoints, see checkpoint.py. A checkpoint in the JSON
+    format is still recovered when the codec's own file does not exist yet.
+    """
+
+    def __init__(self, root_dir, checkpoint_interval=1000, codec=None, metrics=None):
+        self.root_dir = root_dir
+        self.metrics = metrics  # Times fsyncs and checkpoint writes if set
+        self.checkpoint_interval = checkpoint_interval  # Records between checkpoints
+        self.codec = codec or JsonCheckpoint()
+        self.lock = threading.RLock()  # Guards appends and log rotation
+        self.sync_lock = threading.Lock()  # Serializes fsync calls
+        self.generation = 0
+        self.log_file = None
+        self.appended_seq = 0
+        self.synced_seq = 0
+        self.records_since_checkpoint = 0
+        self.checkpoint_in_progress = False
+
+    def checkpoint_path(self, codec=None):
+        return os.path.join(self.root_dir, (codec or self.codec).filename)
+
+    def log_path(self, generation):
+        return os.path.join(self.root_dir, f"oplog_{generation}.log")
+
+    def log_generations(self):
+        generations = []
+        for name in os.listdir(self.root_dir):
+            if name.startswith("oplog_") and name.endswith(".log"):
+                generations.append(int(name[len("oplog_") : -len(".log")]))
+        return sorted(generations)
+
+    def recover(self, restore, apply):
+        """
+        Load the latest checkpoint through restore(state) and replay newer log
+        records through apply(record). Returns True if any state was found.
+        """
+        found = False
+        covered = -1
+        for codec in (self.codec, JsonCheckpoint()):
+            path = self.checkpoint_path(codec)
+            if os.path.exists(path):
+                covered, state = codec.load(path)
+                restore(state)
+                found = True
+                break
+
+        generations = self.log_generations()
+        for generation in generations:
+            if generation <= covered:
+                # Already folded into the checkpoint
+                os.remove(self.log_path(generation))
+                continue
+
+            with open(self.log_path(generation), "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn write at the tail of the log, nothing after it was acknowledged
+                        print(f"Ignoring truncated record in {self.log_path(generation)}")
+                        break
+                    apply(record)
+                    self.records_since_checkpoint += 1
+                    found = True
+
+        self.generation = max(generations + [covered]) + 1
+        self.log_file = open(self.log_path(self.generation), "a")
+        return found
+
+    def append(self, record):
+        """Append a record to the log. The record is durable after commit()."""
+        with self.lock:
+            self.log_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self.appended_seq += 1
+            self.records_since_checkpoint += 1
+            return self.appended_seq
+
+    def commit(self):
+        """
+        Flush and fsync everything appended so far. Concurrent callers share a
+        single fsync: whoever finds its records already synced returns at once.
+        """
+        target = self.appended_seq
+        with self.sync_lock:
+            if self.synced_seq >= target:
+                return
+            with self.lock:
+                self.log_file.flush()
+                target = self.appended_seq
+            start = perf_counter()
+            os.fsync(self.log_file.fileno())
+            if self.metrics:
+                self.metrics.observe_disk("oplog_fsync", perf_counter() - start)
+            self.synced_seq = target
+
+    def maybe_checkpoint(self, snapshot):
+        """
+        Start a background checkpoint if enough records have accumulated.
+        snapshot() must return a copy of the full state that the codec can
+        encode. It is called while appends are blocked, so it sees a
+        consistent view, and the state is encoded in the background.
+        """
+        if self.records_since_checkpoint < self.checkpoint_interval:
+            return
+        job = self.rotate(snapshot)
+        if job is not None:
+            threading.Thread(target=self.write_checkpoint, args=job, daemon=True).start()
+
+    def checkpoint(self, snapshot):
+        """
+        Write a checkpoint of snapshot() and wait for it. Returns whether it
+        was written.
+        """
+        job = self.rotate(snapshot)
+        return job is not None and self.write_checkpoint(*job)
+
+    def rotate(self, snapshot):
+        """
+        Close the current log generation and capture the state it ends with.
+        Returns (state, covered generation) for write_checkpoint, or None if
+        a checkpoint is already being written.
+        """
+        with self.sync_lock:
+            with self.lock:
+                if self.checkpoint_in_progress:
+                    return None
+                self.checkpoint_in_progress = True
+
+                # Close the current generation and switch to a fresh log file
+                self.log_file.flush()
+                os.fsync(self.log_file.fileno())
+                self.log_file.close()
+                self.synced_seq = self.appended_seq
+                covered = self.generation
+                state = snapshot()
+                self.generation += 1
+                self.log_file = open(self.log_path(self.generation), "a")
+                self.records_since_checkpoint = 0
+        return state, covered
+
+    def write_checkpoint(self, state, covered):
+        try:
+            start = perf_counter()
+            tmp_path = self.checkpoint_path() + ".tmp"
+            with open(tmp_path, "wb") as f:
+                self.codec.dump(f, covered, state)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            os.replace(tmp_path, self.checkpoint_path())
+            if self.metrics:
+                self.metrics.observe_disk("checkpoint_write", perf_counter() - start, size)
+
+            # A checkpoint in the older JSON format is superseded
+            legacy_path = self.checkpoint_path(JsonCheckpoint())
+            if legacy_path != self.checkpoint_path() and os.path.exists(legacy_path):
+                os.remove(legacy_path)
+
+            # Logs up to the covered generation are now redundant
+            for generation in self.log_generations():
+                if generation <= covered:
+                    os.remove(self.log_path(generation))
+            print(f"Checkpoint written covering log generation {covered}")
+            return True
+        except Exception as e:
+            print(f"Error writing checkpoint: {e}")
+            return False
+        finally:
+            with self.lock:
+                self.checkpoint_in_progress = False
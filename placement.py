@@ -0,0 +1,85 @@
+import random
+
+
+class RandomPlacement:
+    """
+    Pick replica servers uniformly at random.
+    """
+
+    def choose(self, candidates, count):
+        """
+        candidates is a list of dicts with a "server" address and its latest
+        "free_bytes", "capacity_bytes", "num_requests" and "in_flight"
+        figures. Returns up to count server addresses, primary first.
+        """
+        chosen = random.sample(candidates, min(count, len(candidates)))
+        return [candidate["server"] for candidate in chosen]
+
+
+class LoadAwarePlacement:
+    """
+    Score servers by disk fullness, recent request rate and in-flight
+    re-replication, and place replicas on the best of a random sample.
+
+    Sampling a few more servers than needed (power of d choices) keeps a
+    burst of allocations between two heartbeats from all landing on the
+    same lowest-scored servers.
+    """
+
+    def __init__(
+        self,
+        choices=2,
+        space_weight=1.0,
+        load_weight=2.0,
+        repl_weight=0.5,
+        min_free_bytes=64 * 2**20,
+    ):
+        self.choices = choices
+        self.min_free_bytes = min_free_bytes  # Servers with less free space are skipped
+        self.space_weight = space_weight
+        self.load_weight = load_weight
+        self.repl_weight = repl_weight
+
+    def score(self, candidate, max_requests):
+        capacity = candidate.get("capacity_bytes") or 0
+        free = candidate.get("free_bytes") or 0
+        used_fraction = 1 - free / capacity if capacity else 0.5
+        load = candidate.get("num_requests", 0) / max_requests if max_requests else 0
+        return (
+            self.space_weight * used_fraction
+            + self.load_weight * load
+            + self.repl_weight * candidate.get("in_flight", 0)
+        )
+
+    def choose(self, candidates, count):
+        # Leave out servers that cannot hold another chunk, unless too few remain
+        roomy = [
+            candidate
+            for candidate in candidates
+            if candidate.get("free_bytes") is None
+            or candidate["free_bytes"] >= self.min_free_bytes
+        ]
+        if len(roomy) >= count:
+            candidates = roomy
+
+        sample_size = min(len(candidates), max(count, self.choices * count))
+        sample = random.sample(candidates, sample_size)
+        max_requests = max(
+            (candidate.get("num_requests", 0) for candidate in candidates), default=0
+        )
+        sample.sort(key=lambda candidate: self.score(candidate, max_requests))
+        return [candidate["server"] for candidate in sample[:count]]
+
+
+PLACEMENT_POLICIES = {
+    "random": RandomPlacement,
+    "load_aware": LoadAwarePlacement,
+}
+
+
+def make_placement(name):
+    if name not in PLACEMENT_POLICIES:
+        raise ValueError(
+            f"Unknown placement policy '{name}', expected one of {sorted(PLACEMENT_POLICIES)}"
+        )
+    return PLACEMENT_POLICIES[name]()
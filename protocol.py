@@ -0,0 +1,191 @@
+import json
+import socket
+import asyncio
+import struct
+
+# Every message is a 4-byte big-endian payload length followed by a JSON payload.
+# Chunk data stays out of the JSON: a bytes "content" field is sent raw right
+# after the frame, announced by "content_length" in the JSON payload.
+HEADER = struct.Struct("!I")
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024  # Upper bound accepted from a peer
+CONTENT = "content"
+SENDFILE_MIN_SIZE = 64 * 1024  # Smaller contents are cheaper to read and send at once
+
+
+class ProtocolError(Exception):
+    """Raised when a peer sends a malformed or oversized frame."""
+
+
+def encode_message(message):
+    """
+    Return the frame of a message and the raw content to send after it,
+    None if the message has no binary content.
+    """
+    content = message.get(CONTENT)
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        message = dict(message)
+        del message[CONTENT]
+        message["content_length"] = memoryview(content).nbytes
+    else:
+        content = None
+    payload = json.dumps(message).encode()
+    return HEADER.pack(len(payload)) + payload, content
+
+
+def send_message(sock, message):
+    """Send one message and return its size in bytes."""
+    frame, content = encode_message(message)
+    sock.sendall(frame)
+    if content is None:
+        return len(frame)
+    sock.sendall(content)
+    return len(frame) + memoryview(content).nbytes
+
+
+def send_file(sock, message, file, size):
+    """
+    Send one message with the first size bytes of an open file as its
+    content. Large contents go from the page cache to the socket through
+    sendfile without being copied into Python. Returns the message size.
+    """
+    frame, _ = encode_message(dict(message, content_length=size))
+    if size < SENDFILE_MIN_SIZE:
+        content = file.read(size)
+        sock.sendall(frame + content)
+        sent = len(content)
+    else:
+        sock.sendall(frame)
+        sent = sock.sendfile(file, 0, size)
+    if sent < size:
+        # The frame announced more than is left, the peer cannot resync
+        raise ConnectionError(f"File ended after {sent} of {size} bytes")
+    return len(frame) + sent
+
+
+def recv_exact(sock, size):
+    """
+    Read exactly size bytes, looping over partial reads. Returns None if the
+    peer closed the connection before sending anything.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            if received == 0:
+                return None
+            raise ConnectionError(
+                f"Connection closed after {received} of {size} bytes"
+            )
+        received += count
+    return buffer
+
+
+def recv_frame(sock, max_size=MAX_MESSAGE_SIZE):
+    """
+    Read the payload of one frame. Returns None on a clean end of stream.
+    """
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > max_size:
+        raise ProtocolError(f"Message of {length} bytes exceeds limit of {max_size}")
+    payload = recv_exact(sock, length) if length else bytearray()
+    if payload is None:
+        raise ConnectionError("Connection closed before message payload")
+    return payload
+
+
+def content_length(message, max_size):
+    length = message.get("content_length")
+    if length is not None and not 0 <= length <= max_size:
+        raise ProtocolError(f"Content of {length} bytes exceeds limit of {max_size}")
+    return length
+
+
+def recv_sized_message(sock, max_size=MAX_MESSAGE_SIZE):
+    """
+    Read one message with its binary content, if any. Returns the message
+    and its size in bytes, or (None, 0) on a clean end of stream.
+    """
+    payload = recv_frame(sock, max_size)
+    if payload is None:
+        return None, 0
+    message = json.loads(payload)
+    size = HEADER.size + len(payload)
+    length = content_length(message, max_size)
+    if length is not None:
+        content = recv_exact(sock, length) if length else bytearray()
+        if content is None:
+            raise ConnectionError("Connection closed before message content")
+        message[CONTENT] = content
+        size += length
+    return message, size
+
+
+def recv_message(sock, max_size=MAX_MESSAGE_SIZE):
+    """
+    Read one message. Returns None on a clean end of stream.
+    """
+    return recv_sized_message(sock, max_size)[0]
+
+
+def call(address, message, timeout=None):
+    """
+    Open a connection, send one request and return the response.
+    """
+    with socket.create_connection(tuple(address), timeout=timeout) as s:
+        send_message(s, message)
+        return recv_message(s)
+
+
+async def read_frame(reader, max_size=MAX_MESSAGE_SIZE):
+    """
+    asyncio counterpart of recv_frame.
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ConnectionError("Connection closed inside message header")
+    (length,) = HEADER.unpack(header)
+    if length > max_size:
+        raise ProtocolError(f"Message of {length} bytes exceeds limit of {max_size}")
+    return await reader.readexactly(length)
+
+
+async def read_sized_message(reader, max_size=MAX_MESSAGE_SIZE):
+    """
+    asyncio counterpart of recv_sized_message.
+    """
+    payload = await read_frame(reader, max_size)
+    if payload is None:
+        return None, 0
+    message = json.loads(payload)
+    size = HEADER.size + len(payload)
+    length = content_length(message, max_size)
+    if length is not None:
+        message[CONTENT] = await reader.readexactly(length)
+        size += length
+    return message, size
+
+
+async def read_message(reader, max_size=MAX_MESSAGE_SIZE):
+    """
+    asyncio counterpart of recv_message.
+    """
+    return (await read_sized_message(reader, max_size))[0]
+
+
+async def write_message(writer, message):
+    frame, content = encode_message(message)
+    writer.write(frame)
+    size = len(frame)
+    if content is not None:
+        writer.write(content)
+        size += memoryview(content).nbytes
+    await writer.drain()
+    return size
@@ -0,0 +1,162 @@
+import heapq
+import threading
+
+
+class ReplicationScheduler:
+    """
+    Background re-replication of chunks.
+
+    Chunks are queued with the replica count they should reach and served
+    most-under-replicated first by a pool of worker threads. Every copy
+    occupies a slot on both its source and its target server, and no server
+    takes part in more than max_per_server copies at once.
+
+    plan(chunk_id) must return (live_servers, candidate_targets) and
+    copy(chunk_id, source, target) must return True once the new replica is
+    recorded in the master metadata.
+    """
+
+    def __init__(self, plan, copy, workers=4, max_per_server=2):
+        self.plan = plan
+        self.copy = copy
+        self.workers = workers
+        self.max_per_server = max_per_server
+        self.condition = threading.Condition()
+        self.queue = []  # Heap of (live - desired, sequence, chunk id)
+        self.desired = {}  # Queued chunk id -> replica count to reach
+        self.blocked = []  # Chunk ids waiting for a free source or target slot
+        self.in_flight = {}  # Server id -> copies it is taking part in
+        self.sequence = 0
+        self.metrics = {
+            "scheduled": 0,
+            "completed": 0,
+            "failed": 0,
+            "in_progress": 0,
+        }
+
+    def start(self):
+        for _ in range(self.workers):
+            threading.Thread(target=self.run_worker, daemon=True).start()
+
+    def schedule(self, chunk_id, desired, live):
+        """
+        Queue a chunk to reach desired replicas. live is its current count
+        of healthy replicas and sets its priority.
+        """
+        with self.condition:
+            if chunk_id in self.desired:
+                # Already queued, keep the higher target
+                self.desired[chunk_id] = max(self.desired[chunk_id], desired)
+                return
+            self.desired[chunk_id] = desired
+            self.push(chunk_id, live)
+            self.metrics["scheduled"] += 1
+            self.condition.notify()
+
+    def push(self, chunk_id, live):
+        self.sequence += 1
+        heapq.heappush(
+            self.queue, (live - self.desired[chunk_id], self.sequence, chunk_id)
+        )
+
+    def cancel(self, chunk_id):
+        """
+        Stop adding replicas to a chunk. A copy already running completes.
+        """
+        with self.condition:
+            self.desired.pop(chunk_id, None)
+            self.blocked = [entry for entry in self.blocked if entry[0] != chunk_id]
+
+    def pending(self, server_id):
+        """Number of copies a server is currently taking part in."""
+        with self.condition:
+            return self.in_flight.get(server_id, 0)
+
+    def stats(self):
+        with self.condition:
+            stats = dict(self.metrics)
+            stats["queued"] = len(self.queue)
+            stats["blocked"] = len(self.blocked)
+            return stats
+
+    def has_slot(self, server_id):
+        return self.in_flight.get(server_id, 0) < self.max_per_server
+
+    def acquire(self):
+        """
+        Pop the most urgent chunk that has a free source and target slot.
+        Returns (chunk id, desired, source, target), blocking until one exists.
+        """
+        while True:
+            while not self.queue:
+                self.condition.wait()
+
+            _, _, chunk_id = heapq.heappop(self.queue)
+            desired = self.desired.get(chunk_id)
+            if desired is None:
+                continue  # Cancelled while queued
+            live, targets = self.plan(chunk_id)
+            if len(live) >= desired:
+                del self.desired[chunk_id]
+                continue
+            if not live or not targets:
+                print(f"REPL: No source or target available for chunk {chunk_id}")
+                del self.desired[chunk_id]
+                self.metrics["failed"] += 1
+                continue
+
+            source = next((s for s in live if self.has_slot(self.server_id(s))), None)
+            target = next(
+                (t for t in targets if self.has_slot(self.server_id(t))), None
+            )
+            if source is None or target is None:
+                # Retry once a running copy releases its slots
+                self.blocked.append((chunk_id, len(live)))
+                continue
+
+            for server in (source, target):
+                server_id = self.server_id(server)
+                self.in_flight[server_id] = self.in_flight.get(server_id, 0) + 1
+            self.metrics["in_progress"] += 1
+            return chunk_id, desired, source, target
+
+    def release(self, chunk_id, source, target, success):
+        for server in (source, target):
+            server_id = self.server_id(server)
+            self.in_flight[server_id] -= 1
+            if not self.in_flight[server_id]:
+                del self.in_flight[server_id]
+        self.metrics["in_progress"] -= 1
+        self.metrics["completed" if success else "failed"] += 1
+
+        # Freed slots may unblock waiting chunks
+        for blocked_id, live in self.blocked:
+            self.push(blocked_id, live)
+        self.blocked = []
+
+        desired = self.desired.pop(chunk_id, None)
+        if success and desired is not None:
+            # Requeue if the chunk still needs more replicas
+            live, _ = self.plan(chunk_id)
+            if len(live) < desired:
+                self.desired[chunk_id] = desired
+                self.push(chunk_id, len(live))
+        self.condition.notify_all()
+
+    def run_worker(self):
+        while True:
+            with self.condition:
+                chunk_id, desired, source, target = self.acquire()
+
+            success = False
+            try:
+                success = self.copy(chunk_id, source, target)
+            except Exception as e:
+                print(f"REPL: Error copying chunk {chunk_id} to {target}: {e}")
+
+            with self.condition:
+                self.release(chunk_id, source, target, success)
+
+    @staticmethod
+    def server_id(server):
+        return f"{server[0]}:{server[1]}"
@@ -0,0 +1,177 @@
+import socket
+import threading
+import argparse
+from time import time, sleep
+
+from chunktable import ChunkTable
+from master import MasterServer
+from metrics import Metrics
+from tracing import Tracer
+from namespace import Namespace, ReadWriteLock
+from protocol import send_message, recv_message
+
+
+class ShadowMaster(MasterServer):
+    """
+    Read-only replica of the master metadata.
+
+    A shadow tails the master's committed mutation stream with LOG_TAIL
+    long polls and applies the records to its own in-memory state, then
+    serves READ, BATCH_LOOKUP and LS from it. It trails the master by at
+    most one poll round trip while connected, and refuses reads once it
+    has not heard from the master for max_staleness seconds so clients
+    fall back to the master. Shadows keep no log or checkpoint of their
+    own and load the full state from the master when they (re)connect.
+    """
+
+    READ_REQUESTS = ("READ", "BATCH_LOOKUP", "LS")
+
+    def __init__(
+        self,
+        host,
+        port,
+        master_host,
+        master_port,
+        max_staleness=10,
+        metrics_port=None,
+        trace_dir=None,
+    ):
+        # Only the metadata state of MasterServer, none of its log or threads
+        self.host = host
+        self.port = port
+        self.master_address = (master_host, master_port)
+        self.max_staleness = max_staleness  # seconds
+        self.poll_wait = 1  # seconds the master holds a caught-up poll
+        self.state_lock = ReadWriteLock()  # Readers vs applying mutations
+        self.file_to_chunks = {}
+        self.file_chunk_sizes = {}
+        self.namespace = Namespace()
+        self.chunk_locations = ChunkTable()
+        self.next_chunk_id = 0
+        self.epoch = None  # Master run the applied sequence belongs to
+        self.applied_seq = 0
+        self.last_sync = 0
+        self.metrics = Metrics("shadow")
+        self.metrics_port = metrics_port
+        self.tracer = Tracer("shadow", trace_dir)
+
+    def start_background_threads(self):
+        if self.metrics_port is not None:
+            self.metrics.serve(self.host, self.metrics_port)
+        threading.Thread(target=self.follow_master, daemon=True).start()
+
+    def follow_master(self):
+        """
+        Keep a connection to the master and apply its mutations as they commit.
+        """
+        while True:
+            try:
+                with socket.create_connection(self.master_address) as s:
+                    while True:
+                        send_message(
+                            s,
+                            {
+                                "type": "LOG_TAIL",
+                                "epoch": self.epoch,
+                                "after": self.applied_seq,
+                                "wait": self.poll_wait,
+                            },
+                        )
+                        response = recv_message(s)
+                        if response is None:
+                            break
+                        self.apply_tail(response)
+            except OSError as e:
+                print(f"Error following master at {self.master_address}: {e}")
+            sleep(self.poll_wait)
+
+    def apply_tail(self, response):
+        self.state_lock.acquire_write()
+        try:
+            if "state" in response:
+                self.restore_metadata(response["state"])
+                print(
+                    f"Shadow loaded {len(self.file_to_chunks)} files and {len(self.chunk_locations)} chunks"
+                )
+            for record in response["records"]:
+                self.apply_mutation(record)
+            self.epoch = response["epoch"]
+            self.applied_seq = response["seq"]
+        finally:
+            self.state_lock.release_write()
+        self.last_sync = time()
+
+    def process_request(self, data):
+        request = data.get("type")
+        if request not in self.READ_REQUESTS:
+            return {
+                "status": "Error",
+                "message": f"Shadow master is read-only, send {request} to the master",
+            }
+        if time() - self.last_sync > self.max_staleness:
+            return {"status": "Error", "message": "Shadow master is out of date"}
+
+        self.state_lock.acquire_read()
+        try:
+            return super().process_request(data)
+        finally:
+            self.state_lock.release_read()
+
+    def lookup_request(self, data):
+        """
+        Answer READ and LS on the event loop under the same read-only and
+        staleness checks as process_request. Returns None if a mutation is
+        being applied, the caller then runs process_request.
+        """
+        request = data.get("type")
+        if request not in ("READ", "LS"):
+            if request in self.READ_REQUESTS:
+                return None
+            return self.process_request(data)  # Rejected without a lock
+        if time() - self.last_sync > self.max_staleness:
+            return {"status": "Error", "message": "Shadow master is out of date"}
+
+        if not self.state_lock.acquire_read(blocking=False):
+            return None
+        try:
+            return super().lookup_request(data)
+        finally:
+            self.state_lock.release_read()
+
+    def commit_metadata(self):
+        pass  # Shadows never change metadata
+
+    def record_chunk_access(self, chunk_id):
+        pass  # Hot chunk replication is driven by the master
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GFS shadow master")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5100)
+    parser.add_argument("--master-host", default="127.0.0.1")
+    parser.add_argument("--master-port", type=int, default=5000)
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Serve clients from an asyncio event loop",
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, help="Port of the HTTP /metrics endpoint"
+    )
+    parser.add_argument("--trace-dir", help="Write spans of traced requests here")
+    args = parser.parse_args()
+
+    shadow = ShadowMaster(
+        args.host,
+        args.port,
+        args.master_host,
+        args.master_port,
+        metrics_port=args.metrics_port,
+        trace_dir=args.trace_dir,
+    )
+    if args.use_async:
+        shadow.start_async()
+    else:
+        shadow.start()
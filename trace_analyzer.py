@@ -0,0 +1,160 @@
+"""
+Print the critical path of the slowest traced requests.
+
+Reads the span files written by the client, master and chunk servers with
+tracing enabled, groups the spans by trace and walks each slow trace from
+its root: of the children of a span, the one finishing last is on the
+critical path, then the one finishing before that child started, and so
+on, as every hop in this system makes its calls one after another. Self
+time is the part of a span not covered by its critical children, such as
+disk I/O on a chunk server or the network between a client span and the
+server span under it.
+
+Usage: python trace_analyzer.py traces/ [--slowest 5] [--min-ms 0] [--trace ID]
+"""
+
+import os
+import sys
+import json
+import argparse
+
+SLACK = 0.0005  # Seconds of clock jitter tolerated between processes
+
+
+def load_spans(paths):
+    spans = []
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = [
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.endswith(".jsonl")
+            ]
+        for name in files:
+            with open(name, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        spans.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        pass  # Line cut short by a killed process
+    return spans
+
+
+def group_traces(spans):
+    traces = {}
+    for span in spans:
+        span["end"] = span["start"] + span["duration"]
+        traces.setdefault(span["trace_id"], []).append(span)
+    return traces
+
+
+def find_root(spans):
+    """The span without a recorded parent, the longest one if several."""
+    ids = {span["span_id"] for span in spans}
+    roots = [span for span in spans if span.get("parent_id") not in ids]
+    return max(roots, key=lambda span: span["duration"])
+
+
+def critical_children(span, children):
+    chain = []
+    cursor = span["end"]
+    for child in sorted(children.get(span["span_id"], []), key=lambda c: -c["end"]):
+        # A server span outlives the response its caller already received by
+        # the time it takes to close the connection
+        child["end"] = min(child["end"], span["end"])
+        child["duration"] = child["end"] - child["start"]
+        if child["end"] <= cursor + SLACK:
+            chain.append(child)
+            cursor = child["start"]
+    chain.reverse()
+    return chain
+
+
+def critical_path(span, children, depth=0, path=None):
+    """
+    Returns [(depth, span, self time)] for the critical path under span.
+    """
+    if path is None:
+        path = []
+    chain = critical_children(span, children)
+    self_time = span["duration"] - sum(child["duration"] for child in chain)
+    path.append((depth, span, max(self_time, 0.0)))
+    for child in chain:
+        critical_path(child, children, depth + 1, path)
+    return path
+
+
+def describe(span):
+    details = [
+        f"{key}={span[key]}"
+        for key in ("chunk_id", "server", "error")
+        if span.get(key) is not None
+    ]
+    label = f"{span['component']} {span['name']}"
+    return label + (f" ({', '.join(details)})" if details else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="Trace directories or span files")
+    parser.add_argument("--slowest", type=int, default=5, help="Traces to show")
+    parser.add_argument(
+        "--min-ms", type=float, default=0, help="Ignore traces faster than this"
+    )
+    parser.add_argument("--trace", help="Show only this trace id")
+    args = parser.parse_args()
+
+    traces = group_traces(load_spans(args.paths))
+    if args.trace:
+        traces = {args.trace: traces.get(args.trace, [])}
+    roots = []
+    for trace_id, spans in traces.items():
+        if spans:
+            roots.append((find_root(spans), spans))
+    roots = [
+        (root, spans)
+        for root, spans in roots
+        if root["duration"] * 1000 >= args.min_ms
+    ]
+    roots.sort(key=lambda entry: -entry[0]["duration"])
+    roots = roots[: args.slowest]
+    if not roots:
+        print("No matching traces")
+        sys.exit(1)
+
+    hops = {}  # (component, name) -> critical path self time over all traces
+    total = 0.0
+    for root, spans in roots:
+        children = {}
+        for span in spans:
+            children.setdefault(span.get("parent_id"), []).append(span)
+
+        print(
+            f"Trace {root['trace_id']}: {describe(root)} "
+            f"{root['duration'] * 1000:.2f} ms, {len(spans)} spans"
+        )
+        print(f"{'total ms':>10}{'self ms':>10}  span")
+        for depth, span, self_time in critical_path(root, children):
+            print(
+                f"{span['duration'] * 1000:>10.2f}{self_time * 1000:>10.2f}  "
+                f"{'  ' * depth}{describe(span)}"
+            )
+            key = (span["component"].split("-")[0], span["name"])
+            hops[key] = hops.get(key, 0.0) + self_time
+        total += root["duration"]
+        print()
+
+    print(f"Critical path self time by hop over {len(roots)} traces")
+    print(f"{'self ms':>10}{'share':>8}  hop")
+    for (component, name), self_time in sorted(hops.items(), key=lambda h: -h[1]):
+        print(
+            f"{self_time * 1000:>10.2f}{self_time / total:>8.1%}  {component} {name}"
+        )
+
+
+if __name__ == "__main__":
+    main()
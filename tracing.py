@@ -0,0 +1,129 @@
+import os
+import json
+import random
+import functools
+import threading
+from time import time, perf_counter
+from contextlib import contextmanager
+
+_local = threading.local()  # Span active on the current thread
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes")
+
+    def __init__(self, trace_id, parent_id, name, attributes):
+        self.trace_id = trace_id
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+
+
+def new_id():
+    return "%016x" % random.getrandbits(64)
+
+
+def current_span():
+    return getattr(_local, "span", None)
+
+
+def inject(message):
+    """
+    Tag an outgoing request with the active trace, if any, so the receiver
+    records its spans as children of the current one. Returns the message.
+    """
+    span = current_span()
+    if span is not None:
+        message["trace"] = {"trace_id": span.trace_id, "parent_id": span.span_id}
+    return message
+
+
+class Tracer:
+    """
+    Records spans of traced requests as JSON lines in a local trace file.
+
+    A trace starts at a client operation and follows the request through
+    the "trace" field of every RPC it makes: servers open their spans as
+    children of the incoming context and inject their own span into the
+    requests they forward. Requests without a trace field cost one dict
+    lookup. Spans are written only when the tracer has a file, but the
+    context is propagated either way so one untraced hop does not cut a
+    trace in two.
+
+    Each line holds trace_id, span_id, parent_id, component, name, start
+    (wall clock seconds), duration (seconds) and the span's attributes.
+    """
+
+    def __init__(self, component, trace_dir=None):
+        self.component = component
+        self.file = None
+        self.lock = threading.Lock()
+        if trace_dir:
+            os.makedirs(trace_dir, exist_ok=True)
+            path = os.path.join(trace_dir, f"{component}-{os.getpid()}.jsonl")
+            self.file = open(path, "a", buffering=1)  # Line buffered, survives kills
+
+    @contextmanager
+    def span(self, name, context=None, root=False, **attributes):
+        """
+        Open a span for the block. It continues the incoming context if one
+        is given, nests under the active span otherwise, and starts a new
+        trace if root is set and tracing is enabled. Yields the span or None.
+        """
+        parent = current_span()
+        if context:
+            span = Span(context["trace_id"], context.get("parent_id"), name, attributes)
+        elif parent is not None:
+            span = Span(parent.trace_id, parent.span_id, name, attributes)
+        elif root and self.file is not None:
+            span = Span(new_id(), None, name, attributes)
+        else:
+            yield None
+            return
+
+        _local.span = span
+        start_time = time()
+        start = perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.attributes["error"] = repr(e)
+            raise
+        finally:
+            _local.span = parent
+            if self.file is not None:
+                self.record(span, start_time, perf_counter() - start)
+
+    def record(self, span, start_time, duration):
+        line = json.dumps(
+            {
+                "trace_id": span.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "component": self.component,
+                "name": span.name,
+                "start": start_time,
+                "duration": duration,
+                **span.attributes,
+            }
+        )
+        with self.lock:
+            self.file.write(line + "\n")
+
+
+def traced(name):
+    """
+    Run a method of an object with a tracer attribute as the root span of
+    a new trace.
+    """
+
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.tracer.span(name, root=True):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorate